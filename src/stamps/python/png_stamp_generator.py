@@ -5,23 +5,712 @@ import os
 import base64
 import time
 import logging
+import functools
+import hashlib
+import itertools
+import struct
+import zlib
 from io import BytesIO
 import math
 import html
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import freetype
 import numpy as np
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import PIL
+from PIL import Image, ImageDraw, ImageFont, features
 from fontTools.ttLib import TTFont
-from fontTools.varLib import instancer
 
 # Configure logging
+# 设置环境变量 STAMP_DEBUG 可开启调试日志
 logging.basicConfig(
-    level=logging.INFO,
+    level=logging.DEBUG if os.environ.get('STAMP_DEBUG') else logging.INFO,
     format='%(levelname)s: %(message)s'
 )
 logger = logging.getLogger('png_stamp_generator')
 
+# Pillow-SIMD 是 Pillow 的直接替代品（版本号带 .postN 后缀），
+# paste/alpha_composite/resize/filter 均有 SSE4/AVX2 向量化实现
+PIL_SIMD = '.post' in PIL.__version__
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug(
+        "Pillow %s (SIMD: %s, libjpeg-turbo: %s)",
+        PIL.__version__, PIL_SIMD, features.check_feature('libjpeg_turbo')
+    )
+
+# 基本布局引擎常量 (Pillow 9.1 起为 ImageFont.Layout.BASIC，9.0 为 ImageFont.LAYOUT_BASIC)
+PIL_LAYOUT_BASIC = getattr(getattr(ImageFont, 'Layout', None), 'BASIC', getattr(ImageFont, 'LAYOUT_BASIC', None))
+
+# 模板 bgResizeFilter 可选值
+RESIZE_FILTERS = {
+    'nearest': Image.NEAREST,
+    'bilinear': Image.BILINEAR,
+    'bicubic': Image.BICUBIC,
+    'lanczos': Image.LANCZOS,
+}
+
+# temp_backgrounds 中预缩放背景画布的文件名：原图路径摘要.原图修改时间.宽x高.滤镜.png
+_RESIZED_BACKGROUND_NAME = re.compile(r'^([0-9a-f]{32})\.(\d+)\.\d+x\d+\.[a-z]+\.png$')
+
+# temp_backgrounds 的总大小上限，超过时从最早写入的画布开始删除
+RESIZED_BACKGROUNDS_MAX_BYTES = 256 << 20
+
+# 文本元素并行渲染的最大线程数 (不超过 CPU 核数)
+MAX_RENDER_WORKERS = min(4, os.cpu_count() or 1)
+
+# 角度与弧度的换算系数 (圆形文本逐字符换算时不再重复计算)
+DEG_TO_RAD = math.pi / 180.0
+RAD_TO_DEG = 180 / math.pi
+
+# 进程内共享的渲染线程池：线程常驻，各线程的 FreeType Face 池在多次生成之间保持有效
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+# 变量字体实例文件路径 -> 生成该文件时持有的锁 (每个实例文件一把，数量与 temp_fonts 中的文件数相当)
+_temp_font_locks = {}
+_temp_font_locks_lock = threading.Lock()
+
+def _temp_font_lock(path):
+    """获取生成指定临时字体文件用的锁"""
+    with _temp_font_locks_lock:
+        return _temp_font_locks.setdefault(path, threading.Lock())
+
+def get_render_executor():
+    """按需创建共享的渲染线程池"""
+    global _render_executor
+    if _render_executor is None:
+        with _render_executor_lock:
+            if _render_executor is None:
+                _render_executor = ThreadPoolExecutor(max_workers=MAX_RENDER_WORKERS)
+    return _render_executor
+
+# FreeType Face 非线程安全，每个线程维护自己的 Face 池 (LRU)：(字体路径, 修改时间) -> [Face, 当前字号(26.6)]
+# 渲染线程常驻，每个线程最多保留 FACE_POOL_MAX 个打开的 Face (各占一个文件描述符)；
+# 变量字体实例是独立的文件路径，随其他字体一起按最近使用淘汰，被淘汰的 Face 随引用释放而关闭
+FACE_POOL_MAX = 8
+_thread_local = threading.local()
+
+def _get_face(font_path, size_26_6):
+    """获取当前线程共享的 FreeType Face，仅在字号变化时调用 set_char_size"""
+    face_pool = getattr(_thread_local, 'face_pool', None)
+    if face_pool is None:
+        face_pool = _thread_local.face_pool = OrderedDict()
+    try:
+        key = (font_path, os.stat(font_path).st_mtime_ns)
+    except OSError:
+        key = (font_path, None)
+    entry = face_pool.get(key)
+    if entry is None:
+        entry = [freetype.Face(font_path), None]
+        face_pool[key] = entry
+        while len(face_pool) > FACE_POOL_MAX:
+            face_pool.popitem(last=False)
+    else:
+        face_pool.move_to_end(key)
+    face = entry[0]
+    if entry[1] != size_26_6:
+        face.set_char_size(size_26_6)
+        entry[1] = size_26_6
+    return face
+
+# 进程级字符映射缓存 (LRU)：(字体路径, 修改时间) -> {码位: 字形索引}
+# 常驻进程中字体 (含变量字体实例) 随模板变化，最多保留 CHAR_INDEX_CACHE_MAX 个字体；字体文件被替换后修改时间变化，不会用到旧的映射
+CHAR_INDEX_CACHE_MAX = 64
+_CHAR_INDEX_CACHE = OrderedDict()
+_CHAR_INDEX_CACHE_LOCK = threading.Lock()
+
+def _get_char_map(font_path, face):
+    """一次性读取字体 cmap，之后按码位查字形索引无需逐字符 FFI 调用"""
+    try:
+        key = (font_path, os.stat(font_path).st_mtime_ns)
+    except OSError:
+        key = (font_path, None)
+    with _CHAR_INDEX_CACHE_LOCK:
+        char_map = _CHAR_INDEX_CACHE.get(key)
+        if char_map is not None:
+            _CHAR_INDEX_CACHE.move_to_end(key)
+            return char_map
+    
+    char_map = dict(face.get_chars())
+    with _CHAR_INDEX_CACHE_LOCK:
+        _CHAR_INDEX_CACHE[key] = char_map
+        while len(_CHAR_INDEX_CACHE) > CHAR_INDEX_CACHE_MAX:
+            _CHAR_INDEX_CACHE.popitem(last=False)
+    return char_map
+
+@functools.lru_cache(maxsize=32)
+def _load_glyph_order(font_path):
+    """
+    读取字体的字形顺序，返回 (字形名称元组, 字形名称 -> 字形索引)
+
+    按字体路径缓存，同一字体的多个文本元素和变体查询不再重复打开和解析字体文件；
+    lazy=True 只解码读取字形顺序所需的表
+    """
+    tt = TTFont(font_path, lazy=True)
+    try:
+        glyph_order = tuple(tt.getGlyphOrder())
+    finally:
+        tt.close()
+    return glyph_order, {name: i for i, name in enumerate(glyph_order)}
+
+@functools.lru_cache(maxsize=32)
+def _load_glyph_variants(font_path):
+    """
+    扫描字体的全部字形名称，返回 {基本字符: 排序后的变体字形名称元组}
+
+    按字体路径缓存：整张字形表每个字体只遍历一次，而不是每个新字符都重新遍历
+    """
+    glyph_order, _ = _load_glyph_order(font_path)
+    
+    glyph_variants = {}
+    
+    # 遍历所有字形，查找变体
+    for glyph_name in glyph_order:
+        # 检查基本字符和其变体（例如：a, a.1, a.2 等）
+        base_char = glyph_name.split('.')[0]
+        if len(base_char) == 1:  # 只处理单个字符的变体
+            glyph_variants.setdefault(base_char, []).append(glyph_name)
+    
+    # 对每个字符的变体进行排序
+    return {char: tuple(sorted(names)) for char, names in glyph_variants.items()}
+
+@functools.lru_cache(maxsize=128)
+def _load_truetype(font_path, font_size):
+    """
+    按 (字体路径, 整数字号) 缓存 ImageFont.truetype 的结果
+
+    同一进程内所有生成器实例共享：相同字体和字号的元素不再重复打开字体文件、设置字号；
+    FreeTypeFont 在 draw.text 调用之间没有可变状态，可以安全共享
+    """
+    return ImageFont.truetype(font_path, font_size)
+
+def _analyze_font_file(font_path):
+    """Analyze font file to determine if it's a variable font and extract axes information"""
+    try:
+        # 检查文件是否存在
+        if not os.path.exists(font_path):
+            logger.error(f"Font file does not exist: {font_path}")
+            return False, None
+
+        # 加载字体 (按需解码：只读取表目录，访问到的 fvar/OS/2 表才会被解析，
+        # 不再为判断是否为可变字体而完整解码 glyf 等大表)
+        try:
+            font = TTFont(font_path, lazy=True)
+        except Exception as e:
+            try:
+                font = TTFont(font_path)
+            except Exception as e:
+                logger.error(f"Error opening font: {e}")
+                return False, None
+        
+        # 检测是否为可变字体
+        is_variable = False
+        
+        # 通过键或表检测可变字体
+        if (hasattr(font, 'keys') and 'fvar' in font.keys()) or \
+           (hasattr(font, 'tables') and 'fvar' in getattr(font, 'tables', {})):
+            is_variable = True
+        elif (hasattr(font, 'keys') and ('gvar' in font.keys() or 'cvar' in font.keys())) or \
+             (hasattr(font, 'tables') and ('gvar' in getattr(font, 'tables', {}) or 'cvar' in getattr(font, 'tables', {}))):
+            is_variable = True
+        
+        # 检查OS/2表中的字重信息
+        weight_class = None
+        try:
+            if 'OS/2' in getattr(font, 'tables', {}) or (hasattr(font, 'keys') and 'OS/2' in font.keys()):
+                os2_table = font['OS/2']
+                if hasattr(os2_table, 'usWeightClass'):
+                    weight_class = os2_table.usWeightClass
+        except Exception:
+            pass
+        
+        # 提取轴信息
+        axes_info = None
+        if is_variable:
+            try:
+                if 'fvar' in getattr(font, 'tables', {}) or (hasattr(font, 'keys') and 'fvar' in font.keys()):
+                    fvar_table = font['fvar']
+                    axes_info = {}
+                    
+                    if hasattr(fvar_table, 'axes'):
+                        for axis in fvar_table.axes:
+                            axes_info[axis.axisTag] = {
+                                'min': float(axis.minValue),
+                                'max': float(axis.maxValue),
+                                'default': float(axis.defaultValue)
+                            }
+            except Exception:
+                # 设置默认轴信息
+                axes_info = {'wght': {'min': 100, 'max': 900, 'default': 400}}
+        
+        font.close()
+        
+        # 强制处理：对明显的可变字体
+        font_name_lower = os.path.basename(font_path).lower()
+        if not is_variable and ('variable' in font_name_lower or 'vf' in font_name_lower.split('.')[0].split('-')):
+            is_variable = True
+            if not axes_info:
+                axes_info = {'wght': {'min': 100, 'max': 900, 'default': 400}}
+        
+        return is_variable, axes_info
+    except Exception as e:
+        logger.error(f"Error analyzing font {font_path}: {e}")
+        return False, None
+
+# 字体分析结果缓存：字体路径 -> (mtime_ns, (is_variable, axes_info))
+_FONT_ANALYSIS_CACHE = {}
+
+def analyze_font(font_path):
+    """
+    带缓存的 _analyze_font_file：按字体路径和修改时间缓存，进程内多次构建字体映射时
+    不再重复完整解析每个字体文件；文件被替换后 mtime 变化会自动重新分析
+    """
+    try:
+        mtime = os.stat(font_path).st_mtime_ns
+    except OSError:
+        return _analyze_font_file(font_path)
+    cached = _FONT_ANALYSIS_CACHE.get(font_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    result = _analyze_font_file(font_path)
+    _FONT_ANALYSIS_CACHE[font_path] = (mtime, result)
+    return result
+
+DEFAULT_FONT_PATHS = (
+    '/System/Library/Fonts/Arial.ttf',  # macOS
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',  # Linux
+    'C:\\Windows\\Fonts\\arial.ttf'  # Windows
+)
+
+@functools.lru_cache(maxsize=1)
+def _find_default_font():
+    """返回第一个存在的系统默认字体路径（每个进程只检查一次）"""
+    for font_path in DEFAULT_FONT_PATHS:
+        if os.path.exists(font_path):
+            return font_path
+    return None
+
+# 允许的系统字体目录 (macOS, Linux, Windows)
+SYSTEM_FONT_DIRS = (
+    '/System/Library/Fonts',
+    '/usr/share/fonts',
+    'C:\\Windows\\Fonts'
+)
+
+def is_allowed_font_path(font_path, base_dir):
+    """
+    检查字体路径是否位于允许的目录中 (上传字体目录、临时字体目录或系统字体目录)
+
+    安全检查依赖路径当前的解析结果 (符号链接可能被替换)，因此不做缓存，每个请求对映射中的每个文件重新检查
+    """
+    # Check if font path is in any allowed directory
+    for allowed_dir in (os.path.join(base_dir, 'uploads', 'fonts'), os.path.join(base_dir, 'uploads', 'temp_fonts')):
+        try:
+            validate_path(font_path, allowed_dir)
+            return True
+        except ValueError:
+            continue
+    
+    # Also allow system fonts
+    font_path_obj = Path(font_path).resolve()
+    for sys_dir in SYSTEM_FONT_DIRS:
+        sys_path = Path(sys_dir)
+        if sys_path.exists():
+            try:
+                font_path_obj.relative_to(sys_path.resolve())
+                return True
+            except ValueError:
+                continue
+    return False
+
+# 字体目录扫描缓存：目录 -> (mtime_ns, {字体族: 字体信息})
+_FONT_DIR_CACHE = {}
+
+def scan_fonts_dir(fonts_dir):
+    """
+    扫描字体目录，返回 {字体族: 字体信息}
+
+    按目录修改时间缓存：增删字体文件会改变目录 mtime，从而触发重新扫描；
+    返回的字典为共享缓存，调用方需要复制后再修改
+    """
+    try:
+        mtime = os.stat(fonts_dir).st_mtime_ns
+    except OSError:
+        return {}
+    cached = _FONT_DIR_CACHE.get(fonts_dir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    
+    fonts = {}
+    # scandir 的目录项自带文件名和类型信息，无需逐个拼接路径再 stat
+    with os.scandir(fonts_dir) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(('.ttf', '.otf')) and entry.is_file():
+                font_family = os.path.splitext(entry.name)[0]
+                
+                # Check if it's a variable font and extract axes information
+                is_variable, axes_info = analyze_font(entry.path)
+                
+                fonts[font_family] = {
+                    'path': entry.path,
+                    'isVariableFont': is_variable,
+                    'variableAxes': axes_info
+                }
+    _FONT_DIR_CACHE[fonts_dir] = (mtime, fonts)
+    return fonts
+
+@functools.lru_cache(maxsize=4)
+def resolve_font_mapping(mapping_items, fonts_dir_mtime, font_mtimes):
+    """
+    将 NestJS 传入的字体映射 ((字体族, 路径) 元组，路径已由调用方按请求通过 is_allowed_font_path 检查)
+    转换为 {字体族: 字体信息}
+
+    NestJS 每个请求都会传入完整映射 (含大量别名)，按映射内容、字体目录修改时间和映射中各字体文件的修改时间缓存：
+    常驻进程中映射不变时不再逐项检查文件是否存在、分析可变字体；上传或删除字体会改变目录 mtime，
+    原地覆盖字体、符号链接改指向其他文件，或映射到字体目录之外的文件发生变化
+    (font_mtimes，((路径, 解析后的路径, mtime_ns 或 None), ...)) 时同样重新解析。
+    返回的字典为共享缓存，调用方需要复制后再修改
+    """
+    font_map = {}
+    # 别名指向同一个文件，每个文件只检查和分析一次
+    resolved = {}
+    for font_name, font_path in mapping_items:
+        try:
+            if font_path not in resolved:
+                resolved[font_path] = None
+                if not os.path.exists(font_path):
+                    logger.warning(f"Font path from NestJS does not exist: {font_path}")
+                else:
+                    # Check if it's a variable font and extract axes information
+                    resolved[font_path] = analyze_font(font_path)
+            
+            font_info = resolved[font_path]
+            if font_info is not None:
+                is_variable, axes_info = font_info
+                font_map[font_name] = {
+                    'path': font_path,
+                    'isVariableFont': is_variable,
+                    'variableAxes': axes_info
+                }
+        except Exception as e:
+            logger.error(f"Error validating font path {font_path}: {e}")
+            continue
+    return font_map
+
+@functools.lru_cache(maxsize=64)
+def hex_to_rgb(hex_color):
+    """Convert hex color string to RGB tuple (cached per color string)"""
+    hex_color = hex_color.lstrip('#')
+    if len(hex_color) < 6:
+        raise ValueError(f"Invalid hex color: #{hex_color}")
+    # 整个 RRGGBB 一次解析，再按位取出各通道
+    value = int(hex_color[:6], 16)
+    return ((value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff)
+
+class GlyphAtlas:
+    """
+    字形位图图集：所有栅格化后的字形连续存放在同一个 uint8 缓冲区中
+
+    按 (字体路径, 字号(26.6), 字形索引) 索引，合成时直接读取缓冲区视图，避免大量零散的小对象分配。
+    常驻进程中字体和字号随模板变化，缓冲区超过 max_size 字节时整体丢弃并重新开始
+    """
+
+    def __init__(self, initial_size=1 << 16, max_size=32 << 20):
+        self._initial_size = initial_size
+        self._max_size = max_size
+        self._buffer = np.empty(initial_size, dtype=np.uint8)
+        self._used = 0
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回 (offset, rows, width, bitmap_left, bitmap_top, buffer)，未缓存时返回None"""
+        return self._index.get(key)
+
+    def add(self, key, glyph):
+        """将已渲染的 FreeType 字形位图追加到图集"""
+        bitmap = glyph.bitmap
+        rows, width = bitmap.rows, bitmap.width
+        pixels = np.frombuffer(bytes(bitmap.buffer), dtype=np.uint8).reshape(rows, bitmap.pitch)[:, :width]
+        size = rows * width
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                return entry
+            if self._used + size > self._max_size:
+                # 超出上限：换用新的缓冲区并清空索引 (条目自带所属缓冲区，已取出的条目仍然有效)
+                self._buffer = np.empty(max(self._initial_size, size), dtype=np.uint8)
+                self._used = 0
+                self._index = {}
+            elif self._used + size > len(self._buffer):
+                # 几何增长，已取出的视图仍引用旧缓冲区，不受影响
+                grown = np.empty(min(max(len(self._buffer) * 2, self._used + size), self._max_size), dtype=np.uint8)
+                grown[:self._used] = self._buffer[:self._used]
+                self._buffer = grown
+            self._buffer[self._used:self._used + size] = pixels.ravel()
+            entry = (self._used, rows, width, glyph.bitmap_left, glyph.bitmap_top, self._buffer)
+            self._index[key] = entry
+            self._used += size
+        return entry
+
+    def mask(self, entry):
+        """以图集缓冲区视图构造灰度蒙版 (不复制像素)"""
+        offset, rows, width = entry[:3]
+        buffer = entry[5]
+        return Image.frombuffer('L', (width, rows), buffer[offset:offset + rows * width], 'raw', 'L', 0, 1)
+
+# 进程级字形图集
+_GLYPH_ATLAS = GlyphAtlas()
+
+# 进程级字形度量缓存：(字体路径, 字号(26.6), 字形索引) -> (前进宽度(像素), 是否有墨迹)
+# 超过 GLYPH_ADVANCES_MAX 项时整体清空，常驻进程中不随模板和缩放字号无限增长
+GLYPH_ADVANCES_MAX = 65536
+_GLYPH_ADVANCES = {}
+
+def _load_glyph(face, font_path, size_26_6, glyph_index):
+    """
+    返回字形的 (前进宽度(像素), 图集条目)，无墨迹字形的图集条目为 None
+
+    度量按 (字体, 字号, 字形) 缓存，字形位图已在图集中时无需再调用 FreeType
+    """
+    key = (font_path, size_26_6, glyph_index)
+    cached = _GLYPH_ADVANCES.get(key)
+    if cached is not None:
+        advance_x, has_ink = cached
+        if not has_ink:
+            return advance_x, None
+        atlas_entry = _GLYPH_ATLAS.get(key)
+        if atlas_entry is not None:
+            return advance_x, atlas_entry
+
+    # 先只加载度量信息，不光栅化
+    face.load_glyph(glyph_index, freetype.FT_LOAD_DEFAULT)
+    metrics = face.glyph.metrics
+    advance_x = metrics.horiAdvance / 64
+
+    # 空格、零宽字符等无墨迹字形无需光栅化
+    has_ink = metrics.width > 0
+    atlas_entry = None
+    if has_ink:
+        atlas_entry = _GLYPH_ATLAS.get(key)
+        if atlas_entry is None:
+            face.glyph.render(freetype.FT_RENDER_MODE_NORMAL)
+            atlas_entry = _GLYPH_ATLAS.add(key, face.glyph)
+    if len(_GLYPH_ADVANCES) >= GLYPH_ADVANCES_MAX:
+        _GLYPH_ADVANCES.clear()
+    _GLYPH_ADVANCES[key] = (advance_x, has_ink)
+    return advance_x, atlas_entry
+
+def _write_png_chunk(output, chunk_type, payload):
+    """写出一个PNG数据块：长度 + 类型 + 数据 + CRC (CRC 分段计算，数据不做拼接复制)"""
+    output.write(struct.pack('>I', len(payload)) + chunk_type)
+    output.write(payload)
+    output.write(struct.pack('>I', zlib.crc32(payload, zlib.crc32(chunk_type))))
+
+# 直接编码支持的图像模式 -> (每像素字节数, PNG 颜色类型)
+_PNG_COLOR_TYPES = {'RGBA': (4, 6), 'RGB': (3, 2)}
+
+def encode_png(img, compress_level=1, output=None):
+    """
+    将图像编码为PNG字节 (RGBA/RGB 直接编码)
+
+    每行使用过滤类型0（不过滤）并一次性 zlib 压缩，省去 PIL 编码器的逐行过滤启发式。
+    其他模式的图像回退到 PIL 编码器。
+    指定 output (可写的二进制文件对象) 时直接写入其中并返回 None，否则返回编码后的字节
+    """
+    target = BytesIO() if output is None else output
+    if img.mode not in _PNG_COLOR_TYPES:
+        img.save(target, format='PNG', compress_level=compress_level, optimize=False)
+        return target.getbuffer() if output is None else None
+
+    width, height = img.size
+    channels, color_type = _PNG_COLOR_TYPES[img.mode]
+    stride = width * channels
+    # 每行前置过滤类型字节：直接在 numpy 缓冲区中拼接，像素数据只复制一次
+    scanlines = np.zeros((height, stride + 1), dtype=np.uint8)
+    scanlines[:, 1:] = np.asarray(img).reshape(height, stride)
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)  # 8位深度
+    target.write(b'\x89PNG\r\n\x1a\n')
+    _write_png_chunk(target, b'IHDR', header)
+    _write_png_chunk(target, b'IDAT', zlib.compress(scanlines, compress_level))
+    _write_png_chunk(target, b'IEND', b'')
+    return target.getbuffer() if output is None else None
+
+def alpha_paste(base, overlay, position):
+    """
+    将RGBA图层合成到基础图像上
+
+    两者均为RGBA时使用 alpha_composite（Pillow-SIMD 中向量化程度最高的路径）。
+    以自身为蒙版的 paste 会把 alpha 再乘一次，在透明图层上叠加时边缘发暗，因此只用于非RGBA的目标；
+    位置为负时裁掉落在画布外的部分后再合成
+    """
+    x, y = int(position[0]), int(position[1])
+    if base.mode != 'RGBA':
+        base.paste(overlay, (x, y), overlay)
+        return
+    if overlay.mode != 'RGBA':
+        overlay = overlay.convert('RGBA')
+    src_x, src_y = max(0, -x), max(0, -y)
+    if src_x >= overlay.width or src_y >= overlay.height:
+        return
+    base.alpha_composite(overlay, (max(0, x), max(0, y)), (src_x, src_y))
+
+def _background_path_hash(bg_path):
+    """原图完整路径 (解析符号链接后) 的 blake2b 摘要，用作预缩放画布文件名的前缀"""
+    return hashlib.blake2b(os.path.realpath(bg_path).encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+
+def _resized_background_path(bg_path, mtime_ns, width, height, filter_name):
+    """
+    预缩放背景画布在 uploads/temp_backgrounds 中的文件路径，由原图完整路径、修改时间、尺寸和滤镜唯一确定
+
+    原图路径以摘要表示：backgrounds 下的子目录中同名的文件互不干扰，文件名长度也与原图文件名无关
+    """
+    filter_key = filter_name if filter_name in RESIZE_FILTERS else 'auto'
+    name = f"{_background_path_hash(bg_path)}.{mtime_ns}.{width}x{height}.{filter_key}.png"
+    return os.path.join(os.getcwd(), 'uploads', 'temp_backgrounds', name)
+
+def _prune_resized_backgrounds(cache_dir):
+    """
+    清理 temp_backgrounds：删除原图已删除或已被替换 (修改时间不同) 的画布，
+    剩余文件总大小超过 RESIZED_BACKGROUNDS_MAX_BYTES 时从最早写入的开始删除
+
+    只 stat 原图目录和缓存目录，按文件名中的路径摘要和修改时间判断，不打开画布文件
+    """
+    live = {}
+    backgrounds_dir = os.path.join(os.getcwd(), 'uploads', 'backgrounds')
+    for root, _, files in os.walk(backgrounds_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                live[_background_path_hash(path)] = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+    
+    kept = []
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            match = _RESIZED_BACKGROUND_NAME.match(entry.name)
+            if not match:
+                continue
+            try:
+                if live.get(match.group(1)) != int(match.group(2)):
+                    os.remove(entry.path)
+                    continue
+                stat = entry.stat()
+                kept.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            except OSError as e:
+                logger.debug("Failed to prune resized background %s: %s", entry.path, e)
+    
+    total = sum(size for _, size, _ in kept)
+    for _, size, path in sorted(kept):
+        if total <= RESIZED_BACKGROUNDS_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError as e:
+            logger.debug("Failed to prune resized background %s: %s", path, e)
+
+def _store_resized_background(canvas, cache_path):
+    """
+    将缩放好的背景画布写入 temp_backgrounds，供之后的进程直接读取
+
+    先写临时文件再原子替换，并发的进程不会读到写了一半的文件；写入后清理过期的画布并限制目录总大小
+    """
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        ensure_dir(cache_dir)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        canvas.save(tmp_path, 'PNG', compress_level=1)
+        os.replace(tmp_path, cache_path)
+        _prune_resized_backgrounds(cache_dir)
+    except OSError as e:
+        logger.warning("Failed to store resized background %s: %s", cache_path, e)
+
+@functools.lru_cache(maxsize=8)
+def _load_background_canvas(bg_path, mtime_ns, width, height, filter_name):
+    """
+    解码并缩放背景图，居中放到 width x height 的透明画布上，返回 (画布, 是否完全不透明)
+
+    按 (路径, 修改时间, 画布尺寸, 缩放滤镜) 缓存：同一模板的多次渲染 (常驻进程中) 只解码和缩放一次，
+    调用方拿到的是共享对象，需要 copy() 后再绘制。
+    缩放结果同时保存在 uploads/temp_backgrounds 中，新进程首次使用该背景时直接读取画布，不再解码原图和缩放
+    """
+    cache_path = _resized_background_path(bg_path, mtime_ns, width, height, filter_name)
+    canvas = None
+    try:
+        with Image.open(cache_path) as cached:
+            if cached.mode == 'RGBA' and cached.size == (width, height):
+                cached.load()
+                canvas = cached.copy()
+    except (OSError, ValueError):
+        canvas = None
+    
+    if canvas is None:
+        canvas = _resize_background(bg_path, width, height, filter_name)
+        _store_resized_background(canvas, cache_path)
+    
+    # 文字图层以 alpha_composite 叠加，不会降低不透明度，因此成品是否完全不透明只取决于背景画布
+    opaque = canvas.getchannel('A').getextrema()[0] == 255
+    return canvas, opaque
+
+def _resize_background(bg_path, width, height, filter_name):
+    """解码并缩放背景图，居中放到 width x height 的透明画布上"""
+    bg_img = Image.open(bg_path)
+    
+    # Calculate scaling to fit the target dimensions while preserving aspect ratio
+    bg_width, bg_height = bg_img.size
+    scale_x = width / bg_width
+    scale_y = height / bg_height
+    scale = min(scale_x, scale_y)  # Changed from max to min to preserve aspect ratio
+    
+    # Calculate new dimensions
+    new_width = int(bg_width * scale)
+    new_height = int(bg_height * scale)
+    
+    # 大幅缩小的 JPEG 背景让 libjpeg 直接按 1/2、1/4、1/8 解码 (DCT 域缩放)，
+    # 保留目标尺寸 2 倍以上的分辨率供后续重采样，解码耗时与峰值内存随之下降
+    if bg_img.format == 'JPEG' and scale < 0.5:
+        bg_img.draft('RGB', (new_width * 2, new_height * 2))
+    
+    # RGB/RGBA 背景先缩放再转换：RGB 省去全分辨率的 RGBA 副本以及缩放时的预乘/反预乘，
+    # 结果与先转换后缩放一致 (不透明像素预乘不改变数值)；其他模式 (如调色板) 需先转换
+    if bg_img.mode not in ('RGB', 'RGBA'):
+        bg_img = bg_img.convert('RGBA')
+    
+    # Resize background while preserving aspect ratio
+    # 缩放比例在 0.5~2 之间时 BILINEAR 与 LANCZOS 观感接近但快得多
+    resize_filter = RESIZE_FILTERS.get(filter_name)
+    if resize_filter is None:
+        resize_filter = Image.BILINEAR if 0.5 <= scale <= 2.0 else Image.LANCZOS
+    bg_img = bg_img.resize((new_width, new_height), resize_filter)
+    
+    # Calculate position for centering
+    x_offset = (width - new_width) // 2
+    y_offset = (height - new_height) // 2
+    
+    # Create a new image with the background
+    # 完全不透明的背景 (RGB，或 alpha 全为 255 的 RGBA) 直接整块复制，省去逐像素的 alpha 混合；
+    # 含透明像素的背景仍按 alpha 合成
+    canvas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    if bg_img.mode == 'RGB' or bg_img.getchannel('A').getextrema()[0] == 255:
+        canvas.paste(bg_img, (x_offset, y_offset))
+    else:
+        alpha_paste(canvas, bg_img, (x_offset, y_offset))
+    return canvas
+
+# 已确认存在的目录，避免每次构造生成器都调用 makedirs
+_ENSURED_DIRS = set()
+
+def ensure_dir(path):
+    """确保目录存在，每个进程内每个目录只检查一次"""
+    if path not in _ENSURED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _ENSURED_DIRS.add(path)
+
 def validate_path(user_path, allowed_base_dir):
     """
     验证路径是否在允许的目录内，防止路径遍历攻击
@@ -72,6 +761,19 @@ class PNGStampGenerator:
         self.template = data.get('template', {})
         self.text_elements = data.get('textElements', [])
         
+        # 模板文本元素按 id 索引 (同 id 以第一个为准)
+        self.template_by_id = {}
+        for t in self.template.get('textElements', []):
+            if t.get('id') is not None:
+                self.template_by_id.setdefault(t.get('id'), t)
+        
+        # 文本元素按文本内容索引 (同内容以第一个为准)，渲染时按文本查找元素属性不再线性扫描
+        self.element_by_value = {}
+        for element in self.text_elements:
+            value = element.get('value')
+            if isinstance(value, (str, int, float)):
+                self.element_by_value.setdefault(value, element)
+        
         # 获取模板尺寸
         width = self.template.get('width', 500)
         height = self.template.get('height', 500)
@@ -97,16 +799,39 @@ class PNGStampGenerator:
         
         self.background_image_path = self.template.get('backgroundImagePath', None)
         
+        # PNG zlib 压缩级别（1 最快，9 最小）
+        try:
+            self.png_compress_level = min(9, max(0, int(data.get('pngCompressLevel', 1))))
+        except (TypeError, ValueError):
+            self.png_compress_level = 1
+        
         # Prepare output directory
         self.output_dir = os.path.join(os.getcwd(), 'uploads', 'stamps')
-        os.makedirs(self.output_dir, exist_ok=True)
+        ensure_dir(self.output_dir)
         
         # Map font families to font files
         self.font_map = self._build_font_map()
         
+        # 注册临时字体时替换字体映射用的锁 (元素在渲染线程池中并行渲染)
+        self.font_map_lock = threading.Lock()
+        
+        # 小写字体族名 -> 字体信息，用于忽略大小写的匹配 (同名时保留映射中靠前的一项，与逐项比较的结果一致)
+        self.font_map_lower = {}
+        for name, info in self.font_map.items():
+            self.font_map_lower.setdefault(name.lower(), info)
+        
         # Initialize font cache
         self.font_cache = {}
         
+        # 字体族名 -> 字体信息 的查找结果缓存
+        self.font_info_cache = {}
+        
+        # 本次渲染用到的临时字体文件 (变量字体实例等)，结果缓存据此检查文件是否被替换
+        self.temp_font_paths = set()
+        
+        # 是否有元素或背景渲染失败 (结果不完整，不进入结果缓存)
+        self.render_degraded = False
+        
         # Initialize variable font information cache
         self.variable_font_info = {}
         
@@ -123,175 +848,75 @@ class PNGStampGenerator:
         # Check if we received font mapping from NestJS
         nodejs_font_mapping = self.data.get('fontMapping', {})
         if nodejs_font_mapping:            
-            # Convert NestJS font mapping to our internal format
-            for font_name, font_path in nodejs_font_mapping.items():
+            # Convert NestJS font mapping to our internal format (结果为共享缓存，复制到实例的映射中)
+            fonts_dir = os.path.join(os.getcwd(), 'uploads', 'fonts')
+            try:
+                fonts_dir_mtime = os.stat(fonts_dir).st_mtime_ns
+            except OSError:
+                fonts_dir_mtime = None
+            # SECURITY: 映射中的字体路径每个请求都重新检查 (防止路径遍历)，检查结果不缓存；
+            # 别名指向同一个文件，每个文件只检查和 stat 一次；非字符串的路径直接丢弃
+            allowed = {}
+            font_mtimes = []
+            for font_path in dict.fromkeys(path for path in nodejs_font_mapping.values() if isinstance(path, str)):
                 try:
-                    # SECURITY: Validate font path to prevent path traversal
-                    allowed_font_dirs = [
-                        os.path.join(os.getcwd(), 'uploads', 'fonts'),
-                        os.path.join(os.getcwd(), 'uploads', 'temp_fonts')
-                    ]
-                    
-                    # Check if font path is in any allowed directory
-                    font_path_valid = False
-                    for allowed_dir in allowed_font_dirs:
-                        try:
-                            validate_path(font_path, allowed_dir)
-                            font_path_valid = True
-                            break
-                        except ValueError:
-                            continue
-                    
-                    # Also allow system fonts (macOS, Linux, Windows)
-                    system_font_dirs = [
-                        '/System/Library/Fonts',
-                        '/usr/share/fonts',
-                        'C:\\Windows\\Fonts'
-                    ]
-                    
-                    if not font_path_valid:
-                        font_path_obj = Path(font_path).resolve()
-                        for sys_dir in system_font_dirs:
-                            sys_path = Path(sys_dir)
-                            if sys_path.exists():
-                                try:
-                                    font_path_obj.relative_to(sys_path.resolve())
-                                    font_path_valid = True
-                                    break
-                                except ValueError:
-                                    continue
-                    
-                    if not font_path_valid:
-                        logger.warning(f"Font path from NestJS is not in allowed directories: {font_path}")
-                        continue
-                    
-                    if os.path.exists(font_path):
-                        # Check if it's a variable font and extract axes information
-                        is_variable, axes_info = self._analyze_font(font_path)
-                        
-                        font_map[font_name] = {
-                            'path': font_path,
-                            'isVariableFont': is_variable,
-                            'variableAxes': axes_info
-                        }
-                    else:
-                        logger.warning(f"Font path from NestJS does not exist: {font_path}")
+                    allowed[font_path] = is_allowed_font_path(font_path, os.getcwd())
                 except Exception as e:
                     logger.error(f"Error validating font path {font_path}: {e}")
+                    allowed[font_path] = False
                     continue
+                if not allowed[font_path]:
+                    logger.warning(f"Font path from NestJS is not in allowed directories: {font_path}")
+                    continue
+                # 符号链接改指向修改时间相同的文件时，解析后的路径不同，同样不会用到旧的分析结果
+                real_path = os.path.realpath(font_path)
+                try:
+                    font_mtimes.append((font_path, real_path, os.stat(real_path).st_mtime_ns))
+                except (OSError, ValueError):
+                    font_mtimes.append((font_path, real_path, None))
+            font_mtimes = tuple(font_mtimes)
+            mapping_items = tuple(
+                (name, path) for name, path in nodejs_font_mapping.items() if isinstance(path, str) and allowed[path]
+            )
+            font_map.update(resolve_font_mapping(mapping_items, fonts_dir_mtime, font_mtimes))
         
         # Default font as fallback
-        default_fonts = [
-            '/System/Library/Fonts/Arial.ttf',  # macOS
-            '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',  # Linux
-            'C:\\Windows\\Fonts\\arial.ttf'  # Windows
-        ]
-        
-        # Find a working default font
-        for font_path in default_fonts:
-            if os.path.exists(font_path):
-                font_map['Arial'] = {
-                    'path': font_path,
-                    'isVariableFont': False,
-                    'variableAxes': None
-                }
-                break
+        default_font = _find_default_font()
+        if default_font:
+            font_map['Arial'] = {
+                'path': default_font,
+                'isVariableFont': False,
+                'variableAxes': None
+            }
         
         # Scan the fonts directory for custom fonts only if we don't have a valid mapping from NestJS
+        # (扫描结果按目录 mtime 缓存在模块级，这里复制一份，实例注册临时字体时不会污染缓存)
         if not nodejs_font_mapping:
-            fonts_dir = os.path.join(os.getcwd(), 'uploads', 'fonts')
-            if os.path.exists(fonts_dir):
-                for file in os.listdir(fonts_dir):
-                    if file.lower().endswith(('.ttf', '.otf')):
-                        font_path = os.path.join(fonts_dir, file)
-                        font_family = os.path.splitext(file)[0]
-                        
-                        # Check if it's a variable font and extract axes information
-                        is_variable, axes_info = self._analyze_font(font_path)
-                        
-                        font_map[font_family] = {
-                            'path': font_path,
-                            'isVariableFont': is_variable,
-                            'variableAxes': axes_info
-                        }
+            font_map.update(scan_fonts_dir(os.path.join(os.getcwd(), 'uploads', 'fonts')))
         
         # Simplified log output
-        logger.debug(f"Available fonts: {list(font_map.keys())}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Available fonts: %s", list(font_map.keys()))
         
         return font_map
 
     def _analyze_font(self, font_path):
         """Analyze font file to determine if it's a variable font and extract axes information"""
-        try:
-            # 检查文件是否存在
-            if not os.path.exists(font_path):
-                logger.error(f"Font file does not exist: {font_path}")
-                return False, None
-
-            # 加载字体
-            try:
-                font = TTFont(font_path, lazy=False)
-            except Exception as e:
-                try:
-                    font = TTFont(font_path)
-                except Exception as e:
-                    logger.error(f"Error opening font: {e}")
-                    return False, None
-            
-            # 检测是否为可变字体
-            is_variable = False
-            
-            # 通过键或表检测可变字体
-            if (hasattr(font, 'keys') and 'fvar' in font.keys()) or \
-               (hasattr(font, 'tables') and 'fvar' in getattr(font, 'tables', {})):
-                is_variable = True
-            elif (hasattr(font, 'keys') and ('gvar' in font.keys() or 'cvar' in font.keys())) or \
-                 (hasattr(font, 'tables') and ('gvar' in getattr(font, 'tables', {}) or 'cvar' in getattr(font, 'tables', {}))):
-                is_variable = True
-            
-            # 检查OS/2表中的字重信息
-            weight_class = None
-            try:
-                if 'OS/2' in getattr(font, 'tables', {}) or (hasattr(font, 'keys') and 'OS/2' in font.keys()):
-                    os2_table = font['OS/2']
-                    if hasattr(os2_table, 'usWeightClass'):
-                        weight_class = os2_table.usWeightClass
-            except Exception:
-                pass
-            
-            # 提取轴信息
-            axes_info = None
-            if is_variable:
-                try:
-                    if 'fvar' in getattr(font, 'tables', {}) or (hasattr(font, 'keys') and 'fvar' in font.keys()):
-                        fvar_table = font['fvar']
-                        axes_info = {}
-                        
-                        if hasattr(fvar_table, 'axes'):
-                            for axis in fvar_table.axes:
-                                axes_info[axis.axisTag] = {
-                                    'min': float(axis.minValue),
-                                    'max': float(axis.maxValue),
-                                    'default': float(axis.defaultValue)
-                                }
-                except Exception:
-                    # 设置默认轴信息
-                    axes_info = {'wght': {'min': 100, 'max': 900, 'default': 400}}
-            
-            # 强制处理：对明显的可变字体
-            font_name_lower = os.path.basename(font_path).lower()
-            if not is_variable and ('variable' in font_name_lower or 'vf' in font_name_lower.split('.')[0].split('-')):
-                is_variable = True
-                if not axes_info:
-                    axes_info = {'wght': {'min': 100, 'max': 900, 'default': 400}}
-            
-            return is_variable, axes_info
-        except Exception as e:
-            logger.error(f"Error analyzing font {font_path}: {e}")
-            return False, None
+        return analyze_font(font_path)
 
     def _get_font_info(self, font_family):
-        """Get font info for a given font family"""
+        """Get font info for a given font family (按字体族名缓存查找结果，字体映射变化时清空)"""
+        try:
+            return self.font_info_cache[font_family]
+        except KeyError:
+            pass
+        except TypeError:
+            return self._find_font_info(font_family)
+        font_info = self.font_info_cache[font_family] = self._find_font_info(font_family)
+        return font_info
+
+    def _find_font_info(self, font_family):
+        """在字体映射中查找字体族：精确匹配、忽略大小写、去掉字重后缀，最后回退到默认字体"""
         if not font_family:
             logger.warning("Empty font family provided, using default font")
             return self.font_map.get('Arial', next(iter(self.font_map.values())) if self.font_map else None)
@@ -301,21 +926,21 @@ class PNGStampGenerator:
             return self.font_map[font_family]
             
         # Try case-insensitive matching
-        for name in self.font_map:
-            if name.lower() == font_family.lower():
-                return self.font_map[name]
+        font_info = self.font_map_lower.get(font_family.lower())
+        if font_info is not None:
+            return font_info
         
         # Try to match font family regardless of weight/style suffix
         if '-' in font_family:
             base_family = font_family.split('-')[0]
             if base_family in self.font_map:
-                logger.debug(f"Using {base_family} as fallback for {font_family}")
+                logger.debug("Using %s as fallback for %s", base_family, font_family)
                 return self.font_map[base_family]
                 
             # Try to find any font with the same base family
             for name in self.font_map:
                 if name.startswith(f"{base_family}-"):
-                    logger.debug(f"Using {name} as fallback for {font_family}")
+                    logger.debug("Using %s as fallback for %s", name, font_family)
                     return self.font_map[name]
         
         # If we get here, we couldn't find the font
@@ -372,7 +997,7 @@ class PNGStampGenerator:
                 for default_path in default_fonts:
                     if os.path.exists(default_path):
                         font_path = default_path
-                        logger.debug(f"Using system default font: {font_path}")
+                        logger.debug("Using system default font: %s", font_path)
                         break
                 if not font_path or not os.path.exists(font_path):
                     # Use PIL's default font as a last resort
@@ -386,13 +1011,14 @@ class PNGStampGenerator:
                 # 处理可变字体设置
                 temp_font_path = self._create_instance_of_variable_font(font_path, variable_settings)
                 if temp_font_path:
-                    font = ImageFont.truetype(temp_font_path, int(font_size))
+                    # 实例文件名由字体和轴设置唯一确定且持久保存在 temp_fonts 中，同样可以共享缓存
+                    font = _load_truetype(temp_font_path, int(font_size))
                 else:
                     # 如果无法创建实例，使用原始字体
-                    font = ImageFont.truetype(font_path, int(font_size))
+                    font = _load_truetype(font_path, int(font_size))
             else:
                 # 使用常规字体
-                font = ImageFont.truetype(font_path, int(font_size))
+                font = _load_truetype(font_path, int(font_size))
                 
             self.font_cache[cache_key] = font
             return font
@@ -408,9 +1034,9 @@ class PNGStampGenerator:
                 ]
                 for default_path in default_fonts:
                     if os.path.exists(default_path):
-                        font = ImageFont.truetype(default_path, int(font_size))
+                        font = _load_truetype(default_path, int(font_size))
                         self.font_cache[cache_key] = font
-                        logger.debug(f"Using system fallback font: {default_path}")
+                        logger.debug("Using system fallback font: %s", default_path)
                         return font
                 
                 # If no system fonts work, use PIL's default
@@ -437,7 +1063,7 @@ class PNGStampGenerator:
         try:
             # 创建临时目录（如果不存在）
             temp_dir = os.path.join(os.getcwd(), 'uploads', 'temp_fonts')
-            os.makedirs(temp_dir, exist_ok=True)
+            ensure_dir(temp_dir)
             
             # 计算唯一的输出文件名
             font_name = os.path.basename(font_path)
@@ -445,16 +1071,25 @@ class PNGStampGenerator:
             instance_name = f"{basename}-{''.join(f'{tag}{val}' for tag, val in axis_values.items())}{ext}"
             output_path = os.path.join(temp_dir, instance_name)
             
-            # 如果实例已经存在，直接返回
-            if os.path.exists(output_path):
-                # 确保临时字体被添加到字体映射中
-                self._register_temp_font(output_path)
-                return output_path
-                
-            # 使用fontTools创建指定实例
-            font = TTFont(font_path)
-            instance_font = instancer.instantiateVariableFont(font, axis_values)
-            instance_font.save(output_path)
+            # 同一实例文件的生成在进程内串行化：共享渲染线程池中同一请求的多个元素、或常驻进程中的并发请求
+            # 需要同一实例时只生成一次，其余线程等待后直接使用生成好的文件
+            with _temp_font_lock(output_path):
+                # 如果实例不存在，使用fontTools创建指定实例 (varLib 导入开销较大，只在实际需要生成实例时导入)
+                if not os.path.exists(output_path):
+                    from fontTools.varLib import instancer
+                    font = TTFont(font_path)
+                    instance_font = instancer.instantiateVariableFont(font, axis_values)
+                    # 先写临时文件再原子替换：其他进程 (工作进程池) 只会看到完整的字体文件
+                    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    try:
+                        instance_font.save(tmp_path)
+                        os.replace(tmp_path, output_path)
+                    except Exception:
+                        try:
+                            os.remove(tmp_path)
+                        except OSError:
+                            pass
+                        raise
             
             # 将临时字体添加到字体映射中
             self._register_temp_font(output_path)
@@ -462,6 +1097,8 @@ class PNGStampGenerator:
             return output_path
         except Exception as e:
             logger.error(f"Error creating variable font instance: {e}")
+            # 调用方回退到原始字体，结果与请求不一致
+            self.render_degraded = True
             return None
 
     def _prepare_icon_for_element(self, icon_config, default_height_units):
@@ -515,6 +1152,7 @@ class PNGStampGenerator:
             return icon_image, scaled_width, scaled_height, spacing, placement, rotation_override
         except Exception as error:
             logger.error(f"Failed to load icon image {icon_path}: {error}")
+            self.render_degraded = True
             return None, 0, 0, 0, 'before', None
             
     def _register_temp_font(self, font_path):
@@ -525,6 +1163,8 @@ class PNGStampGenerator:
             font_path (str): 字体文件路径
         """
         try:
+            self.temp_font_paths.add(font_path)
+            
             # 从路径获取字体名称
             font_name = os.path.basename(font_path)
             font_name_without_ext = os.path.splitext(font_name)[0]
@@ -536,20 +1176,32 @@ class PNGStampGenerator:
             # 分析字体
             is_variable, axes_info = self._analyze_font(font_path)
             
-            # 注册到字体映射
-            self.font_map[font_name_without_ext] = {
+            font_info = {
                 'path': font_path,
                 'isVariableFont': is_variable,
                 'variableAxes': axes_info,
                 'isTemporary': True  # 标记为临时字体
             }
+            
+            # 注册到字体映射：元素在多个线程中渲染，其他线程可能正在遍历映射，
+            # 因此在锁内复制后整体替换 (写时复制)，不原地修改正在被遍历的字典
+            with self.font_map_lock:
+                if font_name_without_ext in self.font_map:
+                    return
+                font_map = dict(self.font_map)
+                font_map[font_name_without_ext] = font_info
+                font_map_lower = dict(self.font_map_lower)
+                font_map_lower.setdefault(font_name_without_ext.lower(), font_info)
+                self.font_map, self.font_map_lower = font_map, font_map_lower
+                
+                # 映射已变化，清空查找结果缓存
+                self.font_info_cache.clear()
         except Exception as e:
             logger.error(f"注册临时字体失败: {e}")
 
     def _hex_to_rgb(self, hex_color):
         """Convert hex color string to RGB tuple"""
-        hex_color = hex_color.lstrip('#')
-        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+        return hex_to_rgb(hex_color)
 
     def _create_transparent_image(self):
         """Create a transparent RGBA image"""
@@ -582,33 +1234,32 @@ class PNGStampGenerator:
             # 使用原始文本或转换后的文本来查找元素
             lookup_text = original_text if original_text is not None else text
             
-            for element in self.text_elements:
-                if element.get('value') == lookup_text:
-                    current_element = element
-                    position = element.get('position', {})
-                    element_id = element.get('id')
+            element = self.element_by_value.get(lookup_text)
+            if element is not None:
+                current_element = element
+                position = element.get('position', {})
+                element_id = element.get('id')
                     
-                    # 获取首尾字符变体设置
-                    first_variant = element.get('firstVariant')
-                    last_variant = element.get('lastVariant')
+                # 获取首尾字符变体设置
+                first_variant = element.get('firstVariant')
+                last_variant = element.get('lastVariant')
                     
-                    # 获取自定义padding
-                    custom_padding = element.get('textPadding')
+                # 获取自定义padding
+                custom_padding = element.get('textPadding')
                     
-                    # 保存字体权重信息，无论是否为可变字体都可能会用到
-                    font_weight = element.get('fontWeight')
+                # 保存字体权重信息，无论是否为可变字体都可能会用到
+                font_weight = element.get('fontWeight')
                     
-                    # If autoBold is true, override font weight to bold
-                    stroke_width_from_element = element.get('strokeWidth', 0)
-                    if stroke_width_from_element > 0:
-                        is_autobold_enabled = True
-                        stroke_width = int(round(float(stroke_width_from_element) * self.scale_factor))
+                # If autoBold is true, override font weight to bold
+                stroke_width_from_element = element.get('strokeWidth', 0)
+                if stroke_width_from_element > 0:
+                    is_autobold_enabled = True
+                    stroke_width = int(round(float(stroke_width_from_element) * self.scale_factor))
                     
-                    # 检查是否有可变字体设置
-                    if 'variableFontSettings' in element:
-                        variable_settings = element.get('variableFontSettings')
-                        logger.debug(f"Using explicit variableFontSettings: {variable_settings}")
-                    break
+                # 检查是否有可变字体设置
+                if 'variableFontSettings' in element:
+                    variable_settings = element.get('variableFontSettings')
+                    logger.debug("Using explicit variableFontSettings: %s", variable_settings)
             
             icon_config = current_element.get('icon') if current_element else None
             icon_image, icon_width, icon_height, icon_spacing, icon_placement, icon_rotation = self._prepare_icon_for_element(
@@ -640,7 +1291,8 @@ class PNGStampGenerator:
             if first_variant is not None or last_variant is not None:
                 try:
                     # 渲染带有变体的文本
-                    rendered_text = self._render_text_with_variants(text, font_path, scaled_font_size, first_variant, last_variant)
+                    variant_color = self._hex_to_rgb(color) if isinstance(color, str) else color
+                    rendered_text = self._render_text_with_variants(text, font_path, scaled_font_size, first_variant, last_variant, variant_color)
                     if rendered_text:
                         # 获取渲染后的文本尺寸
                         text_width, text_height = rendered_text.size
@@ -683,7 +1335,7 @@ class PNGStampGenerator:
                             # 将文本粘贴到中心
                             paste_x = padding - text_width // 2
                             paste_y = padding - text_height // 2
-                            rot_img.paste(rendered_text, (paste_x, paste_y), rendered_text)
+                            alpha_paste(rot_img, rendered_text, (paste_x, paste_y))
                             # 旋转
                             rotated = rot_img.rotate(-rotation, expand=True, resample=Image.BICUBIC)
                             
@@ -695,10 +1347,10 @@ class PNGStampGenerator:
                             final_y = int(place_y - (rotated_height / 2) + (text_height / 2))
                             
                             # 粘贴到主图像，不强制限制在边界内
-                            img.paste(rotated, (final_x, final_y), rotated)
+                            alpha_paste(img, rotated, (final_x, final_y))
                         else:
                             # 直接粘贴，使用计算的位置，不强制限制在边界内
-                            img.paste(rendered_text, (int(place_x), int(place_y)), rendered_text)
+                            alpha_paste(img, rendered_text, (place_x, place_y))
                         return
                 except Exception as e:
                     logger.error(f"Error rendering text with variants: {e}")
@@ -736,7 +1388,7 @@ class PNGStampGenerator:
                 
                 # 创建变量字体设置
                 variable_settings = {'wght': wght_value}
-                logger.debug(f"Created variable font settings from fontWeight '{font_weight}': {variable_settings}")
+                logger.debug("Created variable font settings from fontWeight '%s': %s", font_weight, variable_settings)
             
             # 常规权重的显式变量字体设置
             if not variable_settings and not font_weight:
@@ -779,9 +1431,9 @@ class PNGStampGenerator:
                     # 检查此名称的字体是否存在于字体映射中
                     if weighted_font_family in self.font_map:
                         exact_font_family = weighted_font_family
-                        logger.debug(f"Using font with weight in name: {exact_font_family}")
+                        logger.debug("Using font with weight in name: %s", exact_font_family)
                     else:
-                        logger.debug(f"Weighted font name not found: {weighted_font_family}, using base family with variable settings")
+                        logger.debug("Weighted font name not found: %s, using base family with variable settings", weighted_font_family)
                 elif isinstance(font_weight, (int, float)) or (isinstance(font_weight, str) and font_weight.isdigit()):
                     # 数字权重转为名称
                     weight_num = int(font_weight) if isinstance(font_weight, str) else font_weight
@@ -793,16 +1445,16 @@ class PNGStampGenerator:
                         
                         if weighted_font_family in self.font_map:
                             exact_font_family = weighted_font_family
-                            logger.debug(f"Using font with weight in name: {exact_font_family}")
+                            logger.debug("Using font with weight in name: %s", exact_font_family)
                         else:
-                            logger.debug(f"Weighted font name not found: {weighted_font_family}, using base family with variable settings")
+                            logger.debug("Weighted font name not found: %s, using base family with variable settings", weighted_font_family)
             
             # 获取字体，应用可变字体设置（如果有）
             font = self._get_pil_font(exact_font_family, scaled_font_size, variable_settings)
             
             # 如果没有找到带权重的字体，但有权重设置，使用基本字体名称再次尝试
             if font == ImageFont.load_default() and exact_font_family != font_family:
-                logger.debug(f"Falling back to base font family: {font_family}")
+                logger.debug("Falling back to base font family: %s", font_family)
                 font = self._get_pil_font(font_family, scaled_font_size, variable_settings)
             
             # Get position attributes
@@ -955,7 +1607,7 @@ class PNGStampGenerator:
                         'scaleFactor': self.scale_factor,
                         'textScaleFactor': text_scale_factor
                     }
-                    logger.debug(f"Font size adjustment for element {element_id}: original={font_size}, adjusted={actual_font_size}")
+                    logger.debug("Font size adjustment for element %s: original=%s, adjusted=%s", element_id, font_size, actual_font_size)
                 
                 # Calculate position based on alignment
                 place_x = scaled_x
@@ -976,14 +1628,16 @@ class PNGStampGenerator:
                     place_x = self.width - text_width - margin
                 
                 place_y = scaled_y
-                ascent, descent = font.getmetrics()
                 if vert_align == 'top':
                     place_y = scaled_y
                 elif vert_align == 'middle':
-                    _, top, _, bottom = font.getbbox(text)
+                    # 复用上面已计算的边界框 (字体未变)，不再重复排版整段文本
+                    _, top, _, bottom = bbox
                     actual_text_height = bottom - top
                     place_y = scaled_y - actual_text_height / 2 - top
                 else:  # baseline
+                    # 字体度量只有基线对齐需要
+                    ascent, descent = font.getmetrics()
                     place_y = scaled_y - ascent
                 
                 # Create a new image for the rotated text
@@ -1043,7 +1697,7 @@ class PNGStampGenerator:
                         paste_y = max(margin, self.height - rotated_txt.height - margin)
                     
                     # 粘贴旋转后的文本到主图像
-                    img.paste(rotated_txt, (paste_x, paste_y), rotated_txt)
+                    alpha_paste(img, rotated_txt, (paste_x, paste_y))
                 else:
                     # 为非旋转文本添加基于字体大小的垂直偏移
                     # 增加垂直偏移比例以避免底部切割
@@ -1073,8 +1727,8 @@ class PNGStampGenerator:
                             
                         draw.text((place_x, place_y), text, font=font, fill=rgb_color, stroke_width=stroke_width)
                     else:
-                        # 获取整个文本的边界框，用于边界检查
-                        left, top, right, bottom = font.getbbox(text)
+                        # 获取整个文本的边界框，用于边界检查 (复用已计算的结果)
+                        left, top, right, bottom = bbox
                         text_actual_width = right - left
                         
                         # 修复：确保文本是否会超出边界，并保持边距
@@ -1096,6 +1750,7 @@ class PNGStampGenerator:
                 
         except Exception as e:
             logger.error(f"Error drawing text with PIL: {e}")
+            self.render_degraded = True
             # Fallback to simple text rendering
             try:
                 draw = ImageDraw.Draw(img)
@@ -1106,8 +1761,9 @@ class PNGStampGenerator:
 
     def _draw_text_with_letter_spacing(self, draw, text, font, x, y, color, spacing, stroke_width=0):
         """Draw text with custom letter spacing"""
-        # Use textlength for better width calculation
-        char_advances = [draw.textlength(char, font=font) for char in text]
+        # Use textlength for better width calculation (每个不同字符只测量一次)
+        lengths = {char: draw.textlength(char, font=font) for char in set(text)}
+        char_advances = [lengths[char] for char in text]
         
         # Calculate total extra space based on the spacing factor
         # The spacing factor applies to the *default* spacing/advance.
@@ -1126,14 +1782,10 @@ class PNGStampGenerator:
         extra_space_per_gap = avg_advance * (spacing - 1.0)
 
         # Draw each character with the calculated spacing
-        current_x = x
-        for i, char in enumerate(text):
-            # Draw the character
+        # 各字符的起点 = 前面字符的步进宽度与额外间距的累加
+        char_xs = itertools.accumulate((advance + extra_space_per_gap for advance in char_advances[:-1]), initial=x)
+        for char, current_x in zip(text, char_xs):
             draw.text((current_x, y), char, font=font, fill=color, stroke_width=stroke_width)
-            
-            # Move to the next position using the character's advance and extra spacing
-            if i < num_gaps:  # Add spacing only between characters
-                current_x += char_advances[i] + extra_space_per_gap
 
     def _draw_circular_text(self, img, text, font, font_size, center_x, center_y, color, radius, 
                           start_angle, baseline_position, position, original_text=None, stroke_width=0,
@@ -1152,7 +1804,7 @@ class PNGStampGenerator:
                 try:
                     # 尝试将maxAngle转换为数值类型
                     max_angle_limit = float(max_angle_raw)
-                    logger.info(f"从JSON中获取maxAngle参数: {max_angle_raw}, 转换为: {max_angle_limit}")
+                    logger.debug("从JSON中获取maxAngle参数: %s, 转换为: %s", max_angle_raw, max_angle_limit)
                 except (ValueError, TypeError):
                     # 如果转换失败，使用默认值
                     max_angle_limit = 360
@@ -1160,13 +1812,13 @@ class PNGStampGenerator:
             else:
                 # 如果没有设置，使用默认值
                 max_angle_limit = 360
-                logger.info(f"未设置maxAngle参数，使用默认值: {max_angle_limit}")
+                logger.debug("未设置maxAngle参数，使用默认值: %s", max_angle_limit)
                 
             # 确保最大角度在有效范围内
             max_angle_limit = min(max(0, max_angle_limit), 360)
             
             # 添加调试日志
-            logger.info(f"圆形文本参数 - text: '{text}', maxAngle: {max_angle_limit}, radius: {radius}")
+            logger.debug("圆形文本参数 - text: '%s', maxAngle: %s, radius: %s", text, max_angle_limit, radius)
             
             # Adjust text sequence based on baseline position
             reverse_text = baseline_position == 'outside'
@@ -1180,7 +1832,29 @@ class PNGStampGenerator:
                 char_heights = []
                 
                 # Correctly calculate character widths taking kerning into account
-                if text_to_render:
+                # load_default() 返回的位图字体没有 layout_engine，按非基本布局逐个测量前缀
+                layout_engine = getattr(current_font, 'layout_engine', None)
+                if text_to_render and layout_engine is not None and layout_engine == PIL_LAYOUT_BASIC:
+                    # 基本布局引擎下，前缀宽度差 = 字符前进宽度 + 与前一字符的字偶距，
+                    # 可由相邻字符对的宽度直接求出 (结果相同)，避免逐个测量前缀的 O(n²) 开销
+                    lengths = {}
+                    
+                    def measure(s):
+                        width = lengths.get(s)
+                        if width is None:
+                            width = lengths[s] = draw.textlength(s, font=current_font)
+                        return width
+                    
+                    prev_char = None
+                    for char in text_to_render:
+                        if prev_char is None:
+                            char_widths.append(measure(char))
+                        else:
+                            char_widths.append(measure(prev_char + char) - measure(prev_char))
+                        prev_char = char
+                    total_width = sum(char_widths)
+                elif text_to_render:
+                    # 复杂布局 (raqm) 的排版依赖上下文，仍按前缀测量
                     last_width = 0
                     for i in range(1, len(text_to_render) + 1):
                         current_width = draw.textlength(text_to_render[:i], font=current_font)
@@ -1225,11 +1899,14 @@ class PNGStampGenerator:
                 
                 # 计算总角度
                 total_angle_rad = (total_width / radius) * spacing_factor
-                total_angle_deg = total_angle_rad * (180 / math.pi)
+                total_angle_deg = total_angle_rad * RAD_TO_DEG
                 
-                logger.debug(f"角度计算详情: radius={radius}, total_width={total_width}, text_arc_ratio={text_arc_ratio:.4f}, " +
-                            f"original_spacing={original_spacing_factor:.4f}, after_len_adjust={pre_font_spacing_factor:.4f}, " + 
-                            f"final_spacing={spacing_factor:.4f}, total_angle_deg={total_angle_deg:.2f}")
+                logger.debug("角度计算详情: radius=%s, total_width=%s, text_arc_ratio=%.4f, "
+                             "original_spacing=%.4f, after_len_adjust=%.4f, "
+                             "final_spacing=%.4f, total_angle_deg=%.2f",
+                             radius, total_width, text_arc_ratio,
+                             original_spacing_factor, pre_font_spacing_factor,
+                             spacing_factor, total_angle_deg)
                 
                 return char_widths, char_heights, total_width, max_char_height, total_angle_deg, spacing_factor
             
@@ -1237,12 +1914,12 @@ class PNGStampGenerator:
             char_widths, char_heights, total_width, max_char_height, total_angle_deg, spacing_factor = calculate_text_metrics(font, font_size)
             
             # 添加调试日志
-            logger.info(f"圆形文本计算结果 - total_angle_deg: {total_angle_deg}, spacing_factor: {spacing_factor}, total_width: {total_width}")
+            logger.debug("圆形文本计算结果 - total_angle_deg: %s, spacing_factor: %s, total_width: %s", total_angle_deg, spacing_factor, total_width)
             
             # 检查是否超过最大角度，如果超过则缩小字体
             if max_angle_limit > 0 and total_angle_deg > max_angle_limit:
                 # 添加调试日志
-                logger.info(f"圆形文本需要缩放 - 当前角度: {total_angle_deg}, 最大限制: {max_angle_limit}")
+                logger.debug("圆形文本需要缩放 - 当前角度: %s, 最大限制: %s", total_angle_deg, max_angle_limit)
                 
                 # 计算需要的缩放比例
                 scale_factor = max_angle_limit / total_angle_deg
@@ -1252,72 +1929,70 @@ class PNGStampGenerator:
                 # 确保字体大小不会太小
                 adjusted_font_size = max(8, adjusted_font_size)
                 
-                logger.info(f"圆形文本字体缩放 - 原始大小: {font_size}, 调整后: {adjusted_font_size}, 缩放比例: {scale_factor}")
+                logger.debug("圆形文本字体缩放 - 原始大小: %s, 调整后: %s, 缩放比例: %s", font_size, adjusted_font_size, scale_factor)
                 
                 # 获取缩小后的字体
                 element_id = None
                 if original_text:
                     # 找到对应的元素以记录字体调整信息
-                    for element in self.text_elements:
-                        if element.get('value') == original_text:
-                            element_id = element.get('id')
-                            break
+                    element = self.element_by_value.get(original_text)
+                    if element is not None:
+                        element_id = element.get('id')
                 
                 # 找到当前字体的字体名
                 current_font_family = None
                 for name, info in self.font_map.items():
                     if info.get('path') == font.path:
                         current_font_family = name
-                        logger.info(f"找到匹配的字体: {name} -> {font.path}")
+                        logger.debug("找到匹配的字体: %s -> %s", name, font.path)
                         break
                 
                 if not current_font_family:
                     # 如果无法找到字体名，使用路径中的文件名
                     font_name = os.path.basename(font.path)
                     current_font_family = os.path.splitext(font_name)[0]
-                    logger.info(f"无法在字体映射中找到字体，使用文件名: {current_font_family}")
+                    logger.debug("无法在字体映射中找到字体，使用文件名: %s", current_font_family)
                     
                     # 确保这个字体被注册到字体映射中
                     if not any(info.get('path') == font.path for info in self.font_map.values()):
                         self._register_temp_font(font.path)
-                        logger.info(f"将未映射的字体添加到字体映射: {current_font_family}")
+                        logger.debug("将未映射的字体添加到字体映射: %s", current_font_family)
                 
                 # 应用新字体大小
-                logger.info(f"准备获取新字体: 字体名={current_font_family}, 调整后大小={adjusted_font_size}")
+                logger.debug("准备获取新字体: 字体名=%s, 调整后大小=%s", current_font_family, adjusted_font_size)
                 
                 # 检查是否为可变字体
                 is_variable_font = False
                 variable_settings = None
-                for element in self.text_elements:
-                    if element.get('value') == original_text:
-                        # 检查是否有可变字体设置
-                        if 'variableFontSettings' in element:
-                            is_variable_font = True
-                            variable_settings = element.get('variableFontSettings')
-                            logger.info(f"检测到可变字体设置: {variable_settings}")
-                        # 检查字体权重
-                        if 'fontWeight' in element:
-                            font_weight = element.get('fontWeight')
-                            logger.info(f"检测到字体权重: {font_weight}")
-                            if not variable_settings:
-                                # 从fontWeight创建变量设置
-                                wght_value = 400  # 默认值
+                element = self.element_by_value.get(original_text)
+                if element is not None:
+                    # 检查是否有可变字体设置
+                    if 'variableFontSettings' in element:
+                        is_variable_font = True
+                        variable_settings = element.get('variableFontSettings')
+                        logger.debug("检测到可变字体设置: %s", variable_settings)
+                    # 检查字体权重
+                    if 'fontWeight' in element:
+                        font_weight = element.get('fontWeight')
+                        logger.debug("检测到字体权重: %s", font_weight)
+                        if not variable_settings:
+                            # 从fontWeight创建变量设置
+                            wght_value = 400  # 默认值
                                 
-                                # 字符串形式的权重处理
-                                if isinstance(font_weight, str):
-                                    if font_weight.lower() == 'bold':
-                                        wght_value = 700
-                                    elif font_weight.lower() == 'medium':
-                                        wght_value = 500
-                                    elif font_weight.isdigit():
-                                        wght_value = int(font_weight)
-                                # 数字形式的权重处理
-                                elif isinstance(font_weight, (int, float)):
+                            # 字符串形式的权重处理
+                            if isinstance(font_weight, str):
+                                if font_weight.lower() == 'bold':
+                                    wght_value = 700
+                                elif font_weight.lower() == 'medium':
+                                    wght_value = 500
+                                elif font_weight.isdigit():
                                     wght_value = int(font_weight)
+                            # 数字形式的权重处理
+                            elif isinstance(font_weight, (int, float)):
+                                wght_value = int(font_weight)
                                     
-                                variable_settings = {'wght': wght_value}
-                                logger.info(f"从字体权重创建变量设置: {variable_settings}")
-                        break
+                            variable_settings = {'wght': wght_value}
+                            logger.debug("从字体权重创建变量设置: %s", variable_settings)
                         
                 # 获取调整后的字体
                 adjusted_font = self._get_pil_font(current_font_family, adjusted_font_size, variable_settings)
@@ -1327,12 +2002,12 @@ class PNGStampGenerator:
                     
                     # 如果加载失败，尝试将该字体直接加载为普通字体
                     try:
-                        adjusted_font = ImageFont.truetype(font.path, int(adjusted_font_size))
-                        logger.info(f"使用原始字体路径加载调整后的字体: {font.path}")
+                        adjusted_font = _load_truetype(font.path, int(adjusted_font_size))
+                        logger.debug("使用原始字体路径加载调整后的字体: %s", font.path)
                     except Exception as e:
                         logger.error(f"尝试直接加载字体失败: {e}")
                 else:
-                    logger.info(f"成功加载调整后的字体: {adjusted_font.path}, 大小: {adjusted_font_size}")
+                    logger.debug("成功加载调整后的字体: %s, 大小: %s", adjusted_font.path, adjusted_font_size)
                 
                 # 应用调整后的字体
                 font = adjusted_font
@@ -1360,7 +2035,7 @@ class PNGStampGenerator:
                     }
                 
                 # 重新计算所有度量
-                logger.info(f"重新计算调整后文本度量 - 原始角度: {total_angle_deg}, 期望最大角度: {max_angle_limit}")
+                logger.debug("重新计算调整后文本度量 - 原始角度: %s, 期望最大角度: %s", total_angle_deg, max_angle_limit)
                 prev_total_width = total_width  # 保存调整前的总宽度
                 prev_total_angle = total_angle_deg  # 保存调整前的总角度
                 
@@ -1371,9 +2046,9 @@ class PNGStampGenerator:
                 width_change_ratio = total_width / prev_total_width if prev_total_width > 0 else 0
                 angle_change_ratio = total_angle_deg / prev_total_angle if prev_total_angle > 0 else 0
                 
-                logger.info(f"重新计算结果 - 新宽度: {total_width}, 宽度变化比例: {width_change_ratio:.4f}")
-                logger.info(f"重新计算结果 - 新角度: {total_angle_deg}, 角度变化比例: {angle_change_ratio:.4f}")
-                logger.info(f"是否满足要求: {'是' if total_angle_deg <= max_angle_limit else '否'}")
+                logger.debug("重新计算结果 - 新宽度: %s, 宽度变化比例: %.4f", total_width, width_change_ratio)
+                logger.debug("重新计算结果 - 新角度: %s, 角度变化比例: %.4f", total_angle_deg, angle_change_ratio)
+                logger.debug("是否满足要求: %s", '是' if total_angle_deg <= max_angle_limit else '否')
                 
                 # 如果仍然超出限制，记录警告
                 if total_angle_deg > max_angle_limit:
@@ -1385,10 +2060,10 @@ class PNGStampGenerator:
             # Determine starting angle based on layout mode
             if layout_mode == 'centerAligned':
                 start_angle = (base_angle - final_total_angle_deg/2) % 360
-                logger.info(f"圆形文本居中对齐 - base_angle: {base_angle}, final_total_angle_deg: {final_total_angle_deg}, start_angle: {start_angle}")
+                logger.debug("圆形文本居中对齐 - base_angle: %s, final_total_angle_deg: %s, start_angle: %s", base_angle, final_total_angle_deg, start_angle)
             else:
                 start_angle = base_angle
-                logger.info(f"圆形文本起点对齐 - base_angle: {base_angle}, start_angle: {start_angle}")
+                logger.debug("圆形文本起点对齐 - base_angle: %s, start_angle: %s", base_angle, start_angle)
             
             # Current position tracking
             current_angle = start_angle
@@ -1397,7 +2072,7 @@ class PNGStampGenerator:
             # Calculate position for each character
             char_positions = []
             for i, (char, width) in enumerate(zip(text_to_render, char_widths)):
-                char_angle_deg = (width / radius) * spacing_factor * (180 / math.pi)
+                char_angle_deg = (width / radius) * spacing_factor * RAD_TO_DEG
                 center_angle_deg = current_angle + char_angle_deg / 2
                 char_positions.append({
                     'char': char,
@@ -1413,7 +2088,7 @@ class PNGStampGenerator:
             if total_actual_angle > 10:
                 # 使用最终的计算角度进行调整
                 adjustment_ratio = final_total_angle_deg / total_actual_angle
-                logger.info(f"调整字符分布 - total_actual_angle: {total_actual_angle}, final_total_angle_deg: {final_total_angle_deg}, adjustment_ratio: {adjustment_ratio}")
+                logger.debug("调整字符分布 - total_actual_angle: %s, final_total_angle_deg: %s, adjustment_ratio: %s", total_actual_angle, final_total_angle_deg, adjustment_ratio)
                 
                 current_angle = start_angle
                 for pos in char_positions:
@@ -1425,16 +2100,15 @@ class PNGStampGenerator:
             custom_padding = None
             # 使用原始文本或转换后的文本来查找元素
             lookup_text = original_text if original_text is not None else text
-            for element in self.text_elements:
-                if element.get('value') == lookup_text:
-                    custom_padding = element.get('textPadding')
-                    break
+            element = self.element_by_value.get(lookup_text)
+            if element is not None:
+                custom_padding = element.get('textPadding')
             
             # Draw each character
             for pos in char_positions:
                 char = pos['char']
                 center_angle_deg = pos['center_angle_deg']
-                center_angle_rad = center_angle_deg * (math.pi / 180.0)
+                center_angle_rad = center_angle_deg * DEG_TO_RAD
                 
                 # Calculate position on the circle
                 char_x = center_x + radius * math.cos(center_angle_rad)
@@ -1445,7 +2119,7 @@ class PNGStampGenerator:
                 if baseline_position == 'outside':
                     rotation_angle += math.pi
                 
-                rotation_deg = rotation_angle * (180 / math.pi)
+                rotation_deg = rotation_angle * RAD_TO_DEG
                 
                 # Create a small image for this character with adaptive padding
                 # Get font metrics for robust height
@@ -1518,7 +2192,7 @@ class PNGStampGenerator:
                 paste_y = int(char_y - rotated_char.height / 2)
                 
                 # 粘贴到主图像
-                img.paste(rotated_char, (paste_x, paste_y), rotated_char)
+                alpha_paste(img, rotated_char, (paste_x, paste_y))
 
             # Draw icon if requested
             if icon_image and radius > 0 and icon_width > 0 and icon_height > 0:
@@ -1550,7 +2224,7 @@ class PNGStampGenerator:
                 icon_paste_x = int(icon_center_x - icon_img.width / 2)
                 icon_paste_y = int(icon_center_y - icon_img.height / 2)
 
-                img.paste(icon_img, (icon_paste_x, icon_paste_y), icon_img)
+                alpha_paste(img, icon_img, (icon_paste_x, icon_paste_y))
                 
         except Exception as e:
             logger.error(f"Error drawing circular text: {e}")
@@ -1558,27 +2232,7 @@ class PNGStampGenerator:
     def _analyze_font_variants(self, font_path):
         """分析字体的变体（字型）信息"""
         try:
-            # 使用 fontTools 加载字体
-            tt = TTFont(font_path)
-            glyph_set = tt.getGlyphOrder()
-            
-            # 创建字形名称到索引的映射
-            glyph_variants = {}
-            
-            # 遍历所有字形，查找变体
-            for glyph_name in glyph_set:
-                # 检查基本字符和其变体（例如：a, a.1, a.2 等）
-                base_char = glyph_name.split('.')[0]
-                if len(base_char) == 1:  # 只处理单个字符的变体
-                    if base_char not in glyph_variants:
-                        glyph_variants[base_char] = []
-                    glyph_variants[base_char].append(glyph_name)
-            
-            # 对每个字符的变体进行排序
-            for char in glyph_variants:
-                glyph_variants[char].sort()
-            
-            return glyph_variants
+            return _load_glyph_variants(font_path)
         except Exception as e:
             logger.error(f"Error analyzing font variants: {e}")
             return {}
@@ -1604,12 +2258,16 @@ class PNGStampGenerator:
             logger.error(f"Error getting glyph variant: {e}")
             return char
 
-    def _render_text_with_variants(self, text, font_path, font_size, first_variant=None, last_variant=None):
+    def _render_text_with_variants(self, text, font_path, font_size, first_variant=None, last_variant=None, color=None):
         """使用指定的首尾变体渲染文本"""
         try:
-            # 初始化 FreeType 字体
-            face = freetype.Face(font_path)
-            face.set_char_size(int(font_size * 64))  # 设置字体大小
+            # 文本颜色 (RGBA)，每个字形以灰度位图为蒙版填充该颜色
+            fill = (*color[:3], 255) if color else (0, 0, 0, 255)
+            
+            # 获取共享的 FreeType 字体并设置字体大小
+            size_26_6 = int(font_size * 64)
+            face = _get_face(font_path, size_26_6)
+            char_map = _get_char_map(font_path, face)
             
             # 获取字体基本度量信息
             metrics = face.size
@@ -1617,19 +2275,19 @@ class PNGStampGenerator:
             descender = metrics.descender / 64
             height = metrics.height / 64
             
-            # 加载字体以获取字形映射
-            tt = TTFont(font_path)
-            glyph_set = tt.getGlyphOrder()
-            glyph_name_to_index = {name: i for i, name in enumerate(glyph_set)}
+            # 字形名称到索引的映射 (按字体缓存)：只有首尾字符使用变体时才需要，
+            # 普通文本不必为此打开字体文件解析字形顺序
+            glyph_name_to_index = None
             
-            # 首先遍历一次计算总体尺寸和收集字形信息
-            total_width = 0
-            max_height = 0
+            # 第一遍：确定每个有墨迹字形的笔位置和位图，同时计算总宽度和纵向范围
+            pen_x = 0
             min_y = float('inf')
             max_y = float('-inf')
-            glyph_positions = []
+            inked_glyphs = []  # (笔位置x, 图集条目)
+            
+            # 一次性查出全部字符的默认字形索引 (字体未覆盖的字符为 0)，循环内不再逐字符查表
+            base_glyph_indices = [char_map.get(cp, 0) for cp in map(ord, text)]
             
-            # 第一遍：收集所有字形信息
             for i, char in enumerate(text):
                 # 确定是否使用变体
                 use_variant = False
@@ -1649,29 +2307,19 @@ class PNGStampGenerator:
                     # 获取变体字形名称
                     glyph_name = self._get_glyph_variant(char, variant_index, font_path)
                     # 获取字形索引
+                    if glyph_name_to_index is None:
+                        _, glyph_name_to_index = _load_glyph_order(font_path)
                     glyph_index = glyph_name_to_index.get(glyph_name, 0)
                     # 如果变体名称无效，回退到基本字符索引
                     if glyph_index == 0:
-                         glyph_index = face.get_char_index(char)
+                         glyph_index = base_glyph_indices[i]
                 else:
-                    # 对于空格、符号等，直接获取默认字形索引
-                    glyph_index = face.get_char_index(char)
+                    # 对于空格、符号等，直接使用默认字形索引
+                    glyph_index = base_glyph_indices[i]
 
-                # 加载字形，添加错误处理
+                # 加载字形 (度量和位图均有缓存)，添加错误处理
                 try:
-                    # 先加载度量信息，不加载位图
-                    face.load_glyph(glyph_index, freetype.FT_LOAD_RENDER | freetype.FT_LOAD_NO_BITMAP)
-                    metrics = face.glyph.metrics
-                    advance_x = metrics.horiAdvance / 64
-
-                    # 再加载位图用于渲染
-                    face.load_glyph(glyph_index, freetype.FT_LOAD_RENDER)
-                    bitmap = face.glyph.bitmap
-                    glyph_top = face.glyph.bitmap_top
-                    glyph_bottom = glyph_top - bitmap.rows
-                    min_y = min(min_y, glyph_bottom)
-                    max_y = max(max_y, glyph_top)
-
+                    advance_x, atlas_entry = _load_glyph(face, font_path, size_26_6, glyph_index)
                 except freetype.ft_errors.FT_Exception as ft_error:
                     logger.warning(f"FreeType error loading glyph for char '{char}' (index {glyph_index}, name '{glyph_name}'): {ft_error}. Skipping character.")
                     advance_x = 0
@@ -1686,31 +2334,20 @@ class PNGStampGenerator:
                              advance_x = font_size / 3
                              logger.warning(f"Could not load space metrics, estimating advance to {advance_x}")
 
-                    # 存储占位符信息，只包含前进距离
-                    glyph_positions.append({
-                        'width': 0, 'height': 0, 'glyph_index': 0,
-                        'advance_x': advance_x,
-                        'bitmap_left': 0, 'bitmap_top': 0,
-                        'bearing_x': 0, 'bearing_y': 0,
-                        'is_placeholder': True # 标记为占位符
-                    })
-                    total_width += advance_x
+                    # 加载失败的字形只占用前进距离
+                    pen_x += advance_x
                     continue # 继续处理下一个字符
 
-                # 存储有效的字形信息
-                glyph_positions.append({
-                    'width': bitmap.width,
-                    'height': bitmap.rows,
-                    'glyph_index': glyph_index,
-                    'advance_x': advance_x,
-                    'bitmap_left': face.glyph.bitmap_left,
-                    'bitmap_top': face.glyph.bitmap_top,
-                    'bearing_x': metrics.horiBearingX / 64,
-                    'bearing_y': metrics.horiBearingY / 64,
-                    'is_placeholder': False
-                })
+                if atlas_entry is not None:
+                    _, glyph_rows, _, _, glyph_top, _ = atlas_entry
+                    glyph_bottom = glyph_top - glyph_rows
+                    min_y = min(min_y, glyph_bottom)
+                    max_y = max(max_y, glyph_top)
+                    inked_glyphs.append((pen_x, atlas_entry))
                 
-                total_width += advance_x
+                pen_x += advance_x
+            
+            total_width = pen_x
             
             # 使用字体的实际高度
             actual_height = height
@@ -1729,53 +2366,87 @@ class PNGStampGenerator:
             # 基线位置应该在图像底部上方 |descender| 像素处
             baseline_y = img_height - extra_space + descender
             
-            # 从左边的额外空间开始
-            x_offset = extra_space
-            
-            # 第二遍：渲染字形
-            for pos in glyph_positions:
-                # 如果是占位符（加载失败的字形），只移动x偏移量
-                if pos.get('is_placeholder', False):
-                    x_offset += pos['advance_x']
-                    continue
-
-                face.load_glyph(pos['glyph_index'], freetype.FT_LOAD_RENDER)
-                bitmap = face.glyph.bitmap
-                
-                if bitmap.width > 0 and bitmap.rows > 0:
-                    # 转换为 numpy 数组
-                    glyph_array = np.array(bitmap.buffer, dtype=np.uint8).reshape((bitmap.rows, bitmap.width))
-                    # 转换为 PIL 图像
-                    glyph_img = Image.fromarray(glyph_array, mode='L')
-                    # 转换为 RGBA
-                    glyph_rgba = Image.new('RGBA', glyph_img.size, (0, 0, 0, 0))
-                    glyph_rgba.putalpha(glyph_img)
-                    
-                    # 计算字形的精确位置
-                    # 水平位置：考虑字形的左轴承
-                    x_pos = x_offset + pos['bitmap_left']
-                    
-                    # 垂直位置：从基线减去bitmap_top
-                    y_pos = baseline_y - pos['bitmap_top']
-                    
-                    logger.debug(f"Placing glyph at x: {x_pos}, y: {y_pos}")
-                    
-                    # 粘贴到主图像
-                    img.paste(glyph_rgba, (int(x_pos), int(y_pos)), glyph_rgba)
-                
-                # 更新水平位置
-                x_offset += pos['advance_x']
+            # 第二遍：只绘制有墨迹的字形，位置 = 左侧额外空间 + 笔位置 + 左轴承
+            for glyph_x, atlas_entry in inked_glyphs:
+                _, glyph_rows, glyph_width, bitmap_left, bitmap_top, _ = atlas_entry
+                if glyph_width > 0 and glyph_rows > 0:
+                    # 以图集缓冲区视图作为灰度蒙版填充颜色；垂直位置从基线减去bitmap_top
+                    left = int(extra_space + glyph_x + bitmap_left)
+                    top = int(baseline_y - bitmap_top)
+                    img.paste(fill, (left, top, left + glyph_width, top + glyph_rows), _GLYPH_ATLAS.mask(atlas_entry))
             
             return img
         except Exception as e:
             logger.error(f"Error rendering text with variants: {e}")
             return None
 
-    def generate(self):
-        """Generate the stamp in PNG format"""
+    def _render_text_element(self, element):
+        """
+        将单个文本元素渲染到独立的透明图层
+        
+        Returns:
+            (x, y, tile): 裁剪到内容边界的RGBA图块及其在画布上的位置；无内容时返回None
+        """
         try:
-            # Create a transparent base image
-            img = self._create_transparent_image()
+            layer = self._create_transparent_image()
+            
+            # Get element attributes
+            text = element.get('value', '')
+            
+            # 保存原始文本，用于在_draw_text_with_pil中匹配元素
+            original_text = text
+            
+            # Decode HTML entities to fix garbled characters
+            text = html.unescape(text)
+            
+            # Apply uppercase if specified
+            if element.get('isUppercase', False):
+                text = text.upper()
+            
+            # Get template element if available
+            template_element = self.template_by_id.get(element.get('id'), {})
+            
+            font_family = element.get('fontFamily') or template_element.get('fontFamily', 'Arial')
+            font_size = element.get('fontSize') or template_element.get('fontSize', 16)
+            
+            # Get position
+            position = element.get('position') or template_element.get('position', {})
+            x = position.get('x', 10)
+            y = position.get('y', 10)
+            
+            # Get color
+            color_str = element.get('color') or template_element.get('color', '#000000')
+            
+            # Get rotation
+            rotation = position.get('rotation', 0)
+            
+            # Get text alignment
+            text_align = position.get('textAlign', 'left')
+            vert_align = position.get('verticalAlign', 'baseline')
+            
+            # Draw the text
+            self._draw_text_with_pil(layer, text, font_family, font_size, x, y, color_str, rotation, text_align, vert_align, original_text)
+            
+            bbox = layer.getbbox()
+            if not bbox:
+                return None
+            return bbox[0], bbox[1], layer.crop(bbox)
+            
+        except Exception as e:
+            logger.error(f"Error drawing text element: {e}")
+            self.render_degraded = True
+            return None
+
+    def generate(self, output=None):
+        """
+        Generate the stamp in PNG format
+
+        Args:
+            output: 可写的二进制文件对象。指定时PNG直接写入其中，返回的数据为 None
+        """
+        try:
+            img = None
+            opaque = False
             
             # Load background image if specified
             if self.background_image_path:
@@ -1784,87 +2455,45 @@ class PNGStampGenerator:
                     allowed_bg_dir = os.path.join(os.getcwd(), 'uploads', 'backgrounds')
                     bg_path = validate_path(self.background_image_path, allowed_bg_dir)
                     
-                    if os.path.exists(bg_path):
-                        bg_img = Image.open(bg_path).convert('RGBA')
-                        
-                        # Calculate scaling to fit the target dimensions while preserving aspect ratio
-                        bg_width, bg_height = bg_img.size
-                        scale_x = self.width / bg_width
-                        scale_y = self.height / bg_height
-                        scale = min(scale_x, scale_y)  # Changed from max to min to preserve aspect ratio
-                        
-                        # Calculate new dimensions
-                        new_width = int(bg_width * scale)
-                        new_height = int(bg_height * scale)
-                        
-                        # Resize background while preserving aspect ratio
-                        bg_img = bg_img.resize((new_width, new_height), Image.LANCZOS)
-                        
-                        # Calculate position for centering
-                        x_offset = (self.width - new_width) // 2
-                        y_offset = (self.height - new_height) // 2
-                        
-                        # Create a new image with the background
-                        new_img = self._create_transparent_image()
-                        new_img.paste(bg_img, (x_offset, y_offset), bg_img)
-                        img = new_img
+                    try:
+                        bg_mtime = os.stat(bg_path).st_mtime_ns
+                    except OSError:
+                        bg_mtime = None
+                    
+                    if bg_mtime is not None:
+                        # 只接受 RESIZE_FILTERS 中的滤镜名，其余一律按 'auto' 处理 (滤镜名会进入缓存文件名)
+                        filter_name = str(self.template.get('bgResizeFilter', '')).lower()
+                        if filter_name not in RESIZE_FILTERS:
+                            filter_name = 'auto'
+                        bg_canvas, opaque = _load_background_canvas(bg_path, bg_mtime, self.width, self.height, filter_name)
+                        img = bg_canvas.copy()
                 except Exception as e:
                     logger.error(f"Error loading background image: {e}")
+                    self.render_degraded = True
             
-            # Draw text elements
-            for element in self.text_elements:
-                try:
-                    # Get element attributes
-                    text = element.get('value', '')
-                    if not text:
-                        continue
-                    
-                    # 保存原始文本，用于在_draw_text_with_pil中匹配元素
-                    original_text = text
-                    
-                    # Decode HTML entities to fix garbled characters
-                    text = html.unescape(text)
-                    
-                    # Apply uppercase if specified
-                    if element.get('isUppercase', False):
-                        text = text.upper()
-                    
-                    # Get template element if available
-                    template_element = next((t for t in self.template.get('textElements', []) 
-                                           if t.get('id') == element.get('id')), {})
-                    
-                    font_family = element.get('fontFamily') or template_element.get('fontFamily', 'Arial')
-                    font_size = element.get('fontSize') or template_element.get('fontSize', 16)
-                    
-                    # Get position
-                    position = element.get('position') or template_element.get('position', {})
-                    x = position.get('x', 10)
-                    y = position.get('y', 10)
-                    
-                    # Get color
-                    color_str = element.get('color') or template_element.get('color', '#000000')
-                    
-                    # Get rotation
-                    rotation = position.get('rotation', 0)
-                    
-                    # Get text alignment
-                    text_align = position.get('textAlign', 'left')
-                    vert_align = position.get('verticalAlign', 'baseline')
-                    
-                    # Draw the text
-                    self._draw_text_with_pil(img, text, font_family, font_size, x, y, color_str, rotation, text_align, vert_align, original_text)
-                    
-                except Exception as e:
-                    logger.error(f"Error drawing text element: {e}")
+            # Create a transparent base image (有背景时直接使用背景画布的副本，不再额外分配)
+            if img is None:
+                img = self._create_transparent_image()
+            
+            # Draw text elements: 每个元素渲染到独立图层（可并行），再按顺序合成到主图像
+            elements = [element for element in self.text_elements if element.get('value', '')]
+            if len(elements) > 1 and MAX_RENDER_WORKERS > 1:
+                tiles = list(get_render_executor().map(self._render_text_element, elements))
+            else:
+                tiles = [self._render_text_element(element) for element in elements]
             
-            # 如果应用了缩放，考虑添加锐化处理以提高图像质量
-            if self.scale_factor > 1.0:
-                img = img.filter(ImageFilter.SHARPEN)
+            for tile in tiles:
+                if tile:
+                    tile_x, tile_y, tile_img = tile
+                    img.alpha_composite(tile_img, (tile_x, tile_y))
             
-            # Convert to PNG
-            output = BytesIO()
-            img.save(output, format='PNG')
-            data = output.getvalue()
+            # 画布完全不透明时 (如背景铺满画布) 丢弃 alpha 通道，输出 RGB PNG，压缩的数据量减少四分之一；
+            # 不透明与否由缓存的背景画布给出，无需再扫描整幅图像的 alpha 通道
+            if opaque:
+                img = img.convert('RGB')
+            
+            # Convert to PNG (低压缩级别可显著减少 zlib CPU 开销)
+            data = encode_png(img, self.png_compress_level, output)
             
             return data, None, self.font_size_adjustments
             
@@ -1882,59 +2511,194 @@ class PNGStampGenerator:
         elif not filename.lower().endswith('.png'):
             filename += '.png'
         
-        # Generate the stamp
-        data, error, font_size_adjustments = self.generate()
+        # Generate the stamp: 编码结果直接写入同目录下的临时文件，不经过内存缓冲；
+        # 成功后原子替换目标文件，渲染失败时已有的同名印章保持不变
+        output_path = os.path.join(self.output_dir, filename)
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                _, error, font_size_adjustments = self.generate(output=f)
+            if not error:
+                os.replace(tmp_path, output_path)
+        except Exception as e:
+            error = f"Error saving stamp to file: {e}"
         if error:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
             return None, error, None
-        
-        # Save to file
-        output_path = os.path.join(self.output_dir, filename)
+        return f"/stamps/{filename}", None, font_size_adjustments
+
+try:
+    # orjson 可选：C 实现的 JSON 序列化，直接输出 bytes
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+try:
+    # pybase64 可选：SIMD 加速的 base64 编码，接口与标准库一致
+    import pybase64 as _base64
+except ImportError:
+    _base64 = base64
+
+def b64encode_ascii(data):
+    """将字节数据 (bytes 或 memoryview，不复制) 编码为 base64 字符串"""
+    return _base64.b64encode(data).decode('ascii')
+
+def write_result(result):
+    """将结果以单行JSON直接写入标准输出的字节流"""
+    sys.stdout.buffer.write(_dumps(result) + b'\n')
+    sys.stdout.buffer.flush()
+
+# 常驻进程内的渲染结果缓存 (LRU)：重试、预览、重复订单等相同输入直接返回上次的结果
+# 每项保存完整的 base64 PNG，按条目数和总字节数 (base64 数据长度) 双重限制
+RESULT_CACHE_SIZE = 32
+RESULT_CACHE_MAX_BYTES = 32 << 20
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+_result_cache_bytes = 0
+
+def _file_mtime_ns(path):
+    """返回文件修改时间 (相对路径按当前工作目录解析)，文件不存在时返回 None"""
+    if not path or not isinstance(path, str):
+        return None
+    try:
+        return os.stat(os.path.join(os.getcwd(), path)).st_mtime_ns
+    except (OSError, ValueError):
+        return None
+
+def _result_cache_key(input_data):
+    """
+    计算渲染结果的缓存键：请求内容 + 所依赖文件 (背景图、图标、字体目录、映射中的字体文件) 的修改时间
+
+    生成结果只由请求内容和这些文件决定，文件被替换后修改时间变化，缓存自然失效。
+    字体映射可以指向系统字体或 temp_fonts 中的文件，原地覆盖也不会改变字体目录的 mtime，因此逐个文件取修改时间
+    """
+    template = input_data.get('template') or {}
+    elements = (input_data.get('textElements') or []) + (template.get('textElements') or [])
+    mtimes = [
+        _file_mtime_ns(template.get('backgroundImagePath')),
+        _file_mtime_ns(os.path.join('uploads', 'fonts')),
+    ]
+    font_mapping = input_data.get('fontMapping')
+    if isinstance(font_mapping, dict):
+        font_paths = sorted({path for path in font_mapping.values() if isinstance(path, str)})
+        mtimes.extend(_file_mtime_ns(path) for path in font_paths)
+    for element in elements:
+        icon = element.get('icon') if isinstance(element, dict) else None
+        if isinstance(icon, dict):
+            mtimes.append(_file_mtime_ns(icon.get('imagePath')))
+    
+    payload = json.dumps(input_data, sort_keys=True, default=str) + json.dumps(mtimes)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+
+def handle_request(input_data):
+    """
+    处理单个生成请求，返回结果字典
+
+    返回数据 (不写文件) 的请求按输入缓存结果，相同输入不再重新渲染。
+    有元素渲染失败或回退 (背景、图标、变量字体实例) 的结果不缓存；渲染中生成的临时字体 (变量字体实例) 记录修改时间，
+    命中时文件有变化则重新渲染
+    """
+    global _result_cache_bytes
+    if 'filename' in input_data:
+        return _generate_result(input_data)[0]
+    
+    try:
+        key = _result_cache_key(input_data)
+    except (TypeError, ValueError):
+        return _generate_result(input_data)[0]
+    
+    with _RESULT_CACHE_LOCK:
+        entry = _RESULT_CACHE.get(key)
+        if entry is not None:
+            result, temp_fonts, size = entry
+            if all(_file_mtime_ns(path) == mtime for path, mtime in temp_fonts):
+                _RESULT_CACHE.move_to_end(key)
+                return result
+            del _RESULT_CACHE[key]
+            _result_cache_bytes -= size
+    
+    result, generator = _generate_result(input_data)
+    size = len(result.get('data', ''))
+    if result.get('success') and not generator.render_degraded and size <= RESULT_CACHE_MAX_BYTES:
+        temp_fonts = tuple((path, _file_mtime_ns(path)) for path in sorted(generator.temp_font_paths))
+        with _RESULT_CACHE_LOCK:
+            previous = _RESULT_CACHE.pop(key, None)
+            if previous is not None:
+                _result_cache_bytes -= previous[2]
+            _RESULT_CACHE[key] = (result, temp_fonts, size)
+            _result_cache_bytes += size
+            while len(_RESULT_CACHE) > RESULT_CACHE_SIZE or _result_cache_bytes > RESULT_CACHE_MAX_BYTES:
+                _, (_, _, evicted_size) = _RESULT_CACHE.popitem(last=False)
+                _result_cache_bytes -= evicted_size
+    return result
+
+def _generate_result(input_data):
+    """实际执行渲染，返回 (结果字典, 生成器)"""
+    # Create stamp generator
+    generator = PNGStampGenerator(input_data)
+    
+    # Check if we need to save to file
+    if 'filename' in input_data:
+        # Save to file and return URL
+        url, error, font_size_adjustments = generator.save_to_file(input_data['filename'])
+        if error:
+            return {'success': False, 'error': error}, generator
+        result = {
+            'success': True,
+            'url': url
+        }
+    else:
+        # Generate and return data as base64
+        data, error, font_size_adjustments = generator.generate()
+        if error:
+            return {'success': False, 'error': error}, generator
+        result = {
+            'success': True,
+            'data': b64encode_ascii(data)
+        }
+    if font_size_adjustments:
+        result['fontSizeAdjustments'] = font_size_adjustments
+    return result, generator
+
+def serve():
+    """
+    常驻模式：逐行读取JSON请求，每个请求输出一行JSON结果。
+    模块导入、字体扫描与分析、字体对象、字形图集和渲染线程池在多个请求之间保持预热
+    """
+    for line in sys.stdin:
+        if not line.strip():
+            continue
         try:
-            with open(output_path, 'wb') as f:
-                f.write(data)
-            return f"/stamps/{filename}", None, font_size_adjustments
+            write_result(handle_request(json.loads(line)))
         except Exception as e:
-            return None, f"Error saving stamp to file: {e}", None
+            write_result({'success': False, 'error': str(e)})
 
 def main():
     # Read JSON input from stdin
     try:
-        input_data = json.loads(sys.stdin.read())
-        
-        # Create stamp generator
-        generator = PNGStampGenerator(input_data)
-        
-        # Check if we need to save to file
-        if 'filename' in input_data:
-            # Save to file and return URL
-            url, error, font_size_adjustments = generator.save_to_file(input_data['filename'])
-            if error:
-                print(json.dumps({'success': False, 'error': error}))
-            else:
-                result = {
-                    'success': True,
-                    'url': url
-                }
-                if font_size_adjustments:
-                    result['fontSizeAdjustments'] = font_size_adjustments
-                print(json.dumps(result))
+        first_line = sys.stdin.readline()
+        try:
+            input_data = json.loads(first_line)
+        except ValueError:
+            # 多行JSON输入，读取剩余部分后整体解析
+            input_data = json.loads(first_line + sys.stdin.read())
         else:
-            # Generate and return data as base64
-            data, error, font_size_adjustments = generator.generate()
-            if error:
-                print(json.dumps({'success': False, 'error': error}))
-            else:
-                result = {
-                    'success': True,
-                    'data': base64.b64encode(data).decode('utf-8')
-                }
-                if font_size_adjustments:
-                    result['fontSizeAdjustments'] = font_size_adjustments
-                print(json.dumps(result))
+            if isinstance(input_data, dict) and input_data.get('mode') == 'server':
+                serve()
+                return
+        
+        write_result(handle_request(input_data))
                 
     except Exception as e:
         # Return error as JSON
-        print(json.dumps({'success': False, 'error': str(e)}))
+        write_result({'success': False, 'error': str(e)})
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -5,27 +5,252 @@ import os
 import base64
 import time
 import logging
+import functools
+import threading
 from io import BytesIO
 from pathlib import Path
-import svgwrite
-from svgwrite import Drawing
-from svgwrite.text import Text
-from svgwrite.shapes import Rect
-from PIL import Image
-from fontTools.ttLib import TTFont
-from fontTools.pens.svgPathPen import SVGPathPen
-import cairo
 import math
-import uharfbuzz as hb
 import re
+import string
 
 # Configure logging
+# 设置环境变量 STAMP_DEBUG 可开启调试日志
 logging.basicConfig(
-    level=logging.INFO,
+    level=logging.DEBUG if os.environ.get('STAMP_DEBUG') else logging.INFO,
     format='%(levelname)s: %(message)s'
 )
 logger = logging.getLogger('stamp_generator')
 
+# Cairo 输出的标签之间的换行/缩进 (字形以 <path>/<use> 输出，标签间没有有效的文本内容)
+_INTER_TAG_WHITESPACE = re.compile(rb'>\s+<')
+
+# SVG 根元素开始标签 (只匹配到第一个 '>'，无回溯风险)
+_SVG_OPEN_TAG = re.compile(r'<svg\b([^>]*)>')
+
+# 根元素上的宽高属性
+_SVG_WIDTH_ATTR = re.compile(r'\bwidth="([^"]*)"')
+_SVG_HEIGHT_ATTR = re.compile(r'\bheight="([^"]*)"')
+
+# 合并背景时根元素需要的命名空间，以及从已有属性中提取各命名空间的正则 (模块加载时编译一次)
+SVG_NAMESPACES = {
+    'xmlns': 'http://www.w3.org/2000/svg',
+    'xmlns:xlink': 'http://www.w3.org/1999/xlink',
+    'xmlns:svg': 'http://www.w3.org/2000/svg',
+    'xmlns:sodipodi': 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd',
+    'xmlns:inkscape': 'http://www.inkscape.org/namespaces/inkscape'
+}
+_SVG_NAMESPACE_ATTRS = {ns: re.compile(rf'{re.escape(ns)}="([^"]*)"') for ns in SVG_NAMESPACES}
+
+# 文档中出现这些前缀时才需要声明对应的命名空间
+_SVG_NAMESPACE_USAGE = {
+    'xmlns:xlink': 'xlink:href',
+    'xmlns:sodipodi': 'sodipodi:',
+    'xmlns:inkscape': 'inkscape:'
+}
+
+# 批量请求并行渲染的最大线程数 (不超过 CPU 核数)
+MAX_BATCH_WORKERS = min(4, os.cpu_count() or 1)
+
+# .svgz 输出的 gzip 压缩级别
+SVGZ_COMPRESS_LEVEL = 6
+
+# 渲染依赖在首次构造生成器时才导入，输入解析失败等提前返回的路径不承担导入开销
+cairo = None
+hb = None
+np = None
+
+def _import_deps():
+    """按需导入 cairo、uharfbuzz 和 numpy"""
+    global cairo, hb, np
+    if cairo is None:
+        import cairo as _cairo
+        import numpy as _np
+        import uharfbuzz as _hb
+        cairo, hb, np = _cairo, _hb, _np
+
+# 支持的字体文件扩展名
+FONT_EXTENSIONS = ('.ttf', '.otf')
+
+# 角度与弧度的换算系数 (圆形文本逐字符换算时不再重复计算)
+DEG_TO_RAD = math.pi / 180.0
+RAD_TO_DEG = 180 / math.pi
+
+# HarfBuzz 排版特性：启用字偶距和连字
+SHAPING_FEATURES = {"kern": True, "liga": True}
+
+def is_simple_text(text):
+    """判断文本是否为纯ASCII (无组合字符、无需复杂排版)，可以不经HarfBuzz直接渲染"""
+    return text.isascii()
+
+# 进程级uharfbuzz缓存：face 按字体路径共享 (解析/校验字体文件开销大)，font 按 (路径, 字号) 共享
+_HB_FACES = {}
+_HB_LOCK = threading.Lock()
+
+def get_hb_face(font_path):
+    """获取缓存的uharfbuzz face，每个字体文件只读取和解析一次"""
+    face = _HB_FACES.get(font_path)
+    if face is None:
+        with _HB_LOCK:
+            face = _HB_FACES.get(font_path)
+            if face is None:
+                face = hb.Face(hb.Blob.from_file_path(font_path))
+                _HB_FACES[font_path] = face
+    return face
+
+@functools.lru_cache(maxsize=256)
+def get_hb_font(font_path, font_size):
+    """
+    获取缓存的uharfbuzz字体对象，不同字号共享同一个 face
+
+    font 对象很轻 (只记录缩放比例)，但缩放适配会产生任意的小数字号，常驻进程中按 LRU 限制数量
+    """
+    font = hb.Font(get_hb_face(font_path))
+    
+    # 设置缩放比例 (uharfbuzz自动处理缩放)
+    font.scale = (int(font_size * 64), int(font_size * 64))
+    return font
+
+# 每个线程复用一个HarfBuzz缓冲区 (批量模式下多线程同时排版)，每次排版前清空内容
+_HB_BUFFERS = threading.local()
+
+@functools.lru_cache(maxsize=1024)
+def shape_text(font_path, font_size, text):
+    """
+    使用uharfbuzz排版文本，结果按 (字体路径, 字号, 文本) 进程级缓存，常驻模式和批量模式下跨请求复用
+    
+    Returns:
+        (glyphs, total_width): glyphs 为 (字形ID, 字符簇, x, y, x前进) 元组，单位为像素，
+        x/y 为相对文本起点的绘制位置 (已累加前进量并计入偏移)。
+        只保存数值而不持有HarfBuzz对象，便于缓存；缓存命中时渲染只需加上起点坐标
+    """
+    font = get_hb_font(font_path, font_size)
+    
+    buf = getattr(_HB_BUFFERS, 'buffer', None)
+    if buf is None:
+        buf = _HB_BUFFERS.buffer = hb.Buffer()
+    buf.clear_contents()
+    buf.add_str(text)
+    buf.direction = "ltr"  # 从左到右
+    buf.script = "Latn"    # 拉丁文
+    buf.language = "en"    # 英语
+    hb.shape(font, buf, SHAPING_FEATURES)
+    
+    # 26.6 定点数在整数域内累加，最后统一换算为像素
+    glyphs = []
+    pen_x = 0
+    for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
+        glyphs.append((
+            info.codepoint,
+            info.cluster,
+            (pen_x + pos.x_offset) / 64.0,
+            -pos.y_offset / 64.0,
+            pos.x_advance / 64.0
+        ))
+        pen_x += pos.x_advance
+    return tuple(glyphs), pen_x / 64.0
+
+# 进程级Cairo字体缓存：缩放字体持有Cairo/FreeType的字形缓存，在生成器之间共享可让常驻模式下的请求复用已加载的字形
+_CAIRO_FONT_FACES = {}
+
+# 预热字形集合：开启预热后，新建缩放字体时即加载这些字形的度量和轮廓
+PREWARM_TEXT = string.digits + string.ascii_letters + string.punctuation + ' '
+_prewarm_fonts = False
+
+def get_cairo_font_face(font_family):
+    """获取缓存的Cairo字体对象，避免每次 select_font_face 都重新匹配字体"""
+    font_face = _CAIRO_FONT_FACES.get(font_family)
+    if font_face is None:
+        font_face = cairo.ToyFontFace(font_family, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+        _CAIRO_FONT_FACES[font_family] = font_face
+    return font_face
+
+@functools.lru_cache(maxsize=256)
+def _create_scaled_font(font_family, font_size, prewarm):
+    """创建Cairo缩放字体；缩放适配会产生任意的小数字号，常驻进程中按 LRU 限制数量"""
+    scaled_font = cairo.ScaledFont(
+        get_cairo_font_face(font_family),
+        cairo.Matrix(xx=font_size, yy=font_size),
+        cairo.Matrix(),
+        cairo.FontOptions()
+    )
+    if prewarm:
+        # 预先加载常用字形，使渲染时命中字形缓存
+        scaled_font.glyph_extents(scaled_font.text_to_glyphs(0, 0, PREWARM_TEXT, False))
+    return scaled_font
+
+def get_scaled_font(font_family, font_size, nominal=False):
+    """
+    获取缓存的Cairo缩放字体，每个 (字体, 字号) 只创建一次，替代反复的 set_font_face/set_font_size
+
+    nominal 表示字号为模板/请求中给出的原始字号；常驻模式下只预热这些字号，缩放适配得到的字号不预热
+    """
+    return _create_scaled_font(font_family, font_size, _prewarm_fonts and nominal)
+
+# 已确认存在的目录，避免每次构造生成器都调用 makedirs
+_ENSURED_DIRS = set()
+
+def split_svg(svg):
+    """
+    拆分 SVG 文档，返回 (根元素属性字符串, 根元素内容)，找不到根元素时返回 None
+
+    开始标签用正则定位，结束标签用 rfind 从尾部查找：线性扫描、无 DOTALL 回溯，
+    内容中嵌套的 <svg> 子元素也不会被截断；位于注释中的 <svg>/</svg> 会被跳过
+    """
+    def in_comment(pos):
+        # 位置之前最近的注释开始标记晚于最近的结束标记，说明处在注释中
+        return svg.rfind('<!--', 0, pos) > svg.rfind('-->', 0, pos)
+
+    open_match = _SVG_OPEN_TAG.search(svg)
+    while open_match and in_comment(open_match.start()):
+        open_match = _SVG_OPEN_TAG.search(svg, open_match.end())
+    if not open_match:
+        return None
+    end = svg.rfind('</svg>')
+    while end >= open_match.end() and in_comment(end):
+        end = svg.rfind('</svg>', open_match.end(), end)
+    if end < open_match.end():
+        return None
+    return open_match.group(1), svg[open_match.end():end]
+
+def extract_svg_namespaces(attrs):
+    """从根元素属性字符串中提取已声明的命名空间，返回 {属性名: URI}"""
+    namespaces = {}
+    for ns, ns_attr in _SVG_NAMESPACE_ATTRS.items():
+        ns_match = ns_attr.search(attrs)
+        if ns_match:
+            namespaces[ns] = ns_match.group(1)
+    return namespaces
+
+def used_svg_namespaces(svg):
+    """返回文档中实际用到前缀的命名空间集合"""
+    return frozenset(ns for ns, token in _SVG_NAMESPACE_USAGE.items() if token in svg)
+
+@functools.lru_cache(maxsize=16)
+def load_svg_background(path, mtime_ns):
+    """
+    读取背景SVG文件并拆分，返回 (split_svg 的结果, 根元素内容的UTF-8字节, 已声明的命名空间, 用到的命名空间,
+    根元素宽, 根元素高)；根元素上没有宽高属性时对应的值为 None
+
+    按 (路径, 修改时间) 缓存：同一模板的多次渲染不再重复读取和扫描背景文件，文件更新后自动失效
+    """
+    with open(path, 'r') as f:
+        bg_svg = f.read()
+    bg_parts = split_svg(bg_svg)
+    bg_attrs = bg_parts[0] if bg_parts else ""
+    width_match = _SVG_WIDTH_ATTR.search(bg_attrs)
+    height_match = _SVG_HEIGHT_ATTR.search(bg_attrs)
+    bg_width = float(width_match.group(1)) if width_match else None
+    bg_height = float(height_match.group(1)) if height_match else None
+    bg_content_bytes = bg_parts[1].encode('utf-8') if bg_parts else None
+    return (bg_parts, bg_content_bytes, extract_svg_namespaces(bg_attrs), used_svg_namespaces(bg_svg),
+            bg_width, bg_height)
+
+def ensure_dir(path):
+    """确保目录存在，每个进程内每个目录只检查一次"""
+    if path not in _ENSURED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _ENSURED_DIRS.add(path)
+
 def validate_path(user_path, allowed_base_dir):
     """
     验证路径是否在允许的目录内，防止路径遍历攻击
@@ -70,148 +295,273 @@ def validate_path(user_path, allowed_base_dir):
     
     return str(user_path_obj)
 
+@functools.lru_cache(maxsize=256)
+def parse_hex_color(color_str):
+    """解析颜色字符串 (#RRGGBB 格式) 为 RGB 值 (0-1范围)，结果按颜色字符串缓存"""
+    hex_digits = color_str[1:7]
+    if len(hex_digits) < 6:
+        raise ValueError(f"Invalid hex color: {color_str}")
+    value = int(hex_digits, 16)
+    return (
+        ((value >> 16) & 0xff) / 255,
+        ((value >> 8) & 0xff) / 255,
+        (value & 0xff) / 255
+    )
+
+def parse_viewport(viewport):
+    """
+    解析可选的视口矩形 {x, y, w, h} (也接受 width/height)，返回 (x0, y0, x1, y1)；
+    未指定或格式无效时返回 None
+    """
+    if not isinstance(viewport, dict):
+        return None
+    try:
+        x = float(viewport.get('x', 0))
+        y = float(viewport.get('y', 0))
+        w = float(viewport.get('w', viewport.get('width')))
+        h = float(viewport.get('h', viewport.get('height')))
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid viewport: {viewport}")
+        return None
+    if w <= 0 or h <= 0:
+        return None
+    return x, y, x + w, y + h
+
+# 系统默认字体候选，用作 Arial 的回退
+DEFAULT_FONTS = (
+    '/System/Library/Fonts/Arial.ttf',  # macOS
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',  # Linux
+    'C:\\Windows\\Fonts\\arial.ttf'  # Windows
+)
+
+@functools.lru_cache(maxsize=1)
+def _find_default_font():
+    """查找第一个存在的系统默认字体 (每个进程只检查一次)"""
+    for font_path in DEFAULT_FONTS:
+        if os.path.exists(font_path):
+            return font_path
+    return None
+
+@functools.lru_cache(maxsize=4)
+def _build_font_map_cached(fonts_dir, mtime_ns):
+    """
+    构建字体族名到字体文件路径的映射
+    
+    结果按 (目录, mtime) 缓存，目录内容不变时长驻进程中重复构造 StampGenerator 不再重新扫描；
+    管理员添加字体后目录 mtime 改变，缓存自动失效。返回的字典在实例间共享，只读使用。
+    
+    Returns:
+        (font_map, font_map_ci): font_map_ci 以小写族名为键，用于不区分大小写的查找
+    """
+    font_map = {}
+    
+    # Find a working default font
+    default_font = _find_default_font()
+    if default_font:
+        font_map['Arial'] = default_font
+    
+    # Scan the fonts directory for custom fonts
+    if mtime_ns is not None:
+        with os.scandir(fonts_dir) as it:
+            for entry in it:
+                name = entry.name
+                if name[-4:].lower() not in FONT_EXTENSIONS or not entry.is_file():
+                    continue
+                font_family = name[:-4]
+                font_map[font_family] = entry.path
+                
+                # Also register without hyphens if the name contains them
+                if '-' in font_family:
+                    font_map[font_family.replace('-', '')] = entry.path
+                    
+                    # 对于 Montserrat 系列字体的特殊处理
+                    if font_family.startswith('Montserrat-'):
+                        # 将所有 Montserrat 变体注册为 Montserrat 字体
+                        font_map['Montserrat'] = entry.path
+    
+    # 小写名称索引，同名冲突时保留先注册的条目
+    font_map_ci = {}
+    for name, path in font_map.items():
+        font_map_ci.setdefault(name.lower(), path)
+    
+    # 简化日志输出
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Available fonts: %s", list(font_map.keys()))
+    
+    return font_map, font_map_ci
+
+def build_font_map(fonts_dir):
+    """Build a mapping of font family names to font file paths"""
+    try:
+        mtime_ns = os.stat(fonts_dir).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    return _build_font_map_cached(fonts_dir, mtime_ns)
+
 class StampGenerator:
     def __init__(self, data):
+        _import_deps()
+        
         self.data = data
         self.template = data.get('template', {})
         self.text_elements = data.get('textElements', [])
+        
+        # 模板文本元素按 id 索引 (同 id 以第一个为准)
+        self.template_by_id = {}
+        for t in self.template.get('textElements', []):
+            if t.get('id') is not None:
+                self.template_by_id.setdefault(t.get('id'), t)
         self.format = 'svg'  # 固定为SVG格式
         self.convert_text_to_paths = data.get('convertTextToPaths', False)
         self.width = self.template.get('width', 500)
         self.height = self.template.get('height', 500)
         self.background_image_path = self.template.get('backgroundImagePath', None)
         
-        # Prepare output directory
-        self.output_dir = os.path.join(os.getcwd(), 'uploads', 'stamps')
-        os.makedirs(self.output_dir, exist_ok=True)
-        
-        # Map font families to font files
-        self.font_map = self._build_font_map()
-        
-        # 初始化uharfbuzz缓存
-        self.hb_fonts = {}
-
-    def _build_font_map(self):
-        """Build a mapping of font family names to font file paths"""
-        font_map = {}
+        # 简单ASCII文本是否跳过HarfBuzz排版 (Cairo 的 show_text 不应用字偶距和连字，默认关闭)
+        self.fast_path = data.get('fastPath', False)
         
-        # Default font as fallback
-        default_fonts = [
-            '/System/Library/Fonts/Arial.ttf',  # macOS
-            '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',  # Linux
-            'C:\\Windows\\Fonts\\arial.ttf'  # Windows
-        ]
+        # 是否将文本栅格化为PNG后嵌入SVG (适用于小尺寸输出)
+        self.rasterize_svg = self.template.get('rasterizeSvg', False)
         
-        # Find a working default font
-        for font_path in default_fonts:
-            if os.path.exists(font_path):
-                font_map['Arial'] = font_path
-                break
+        # 是否将背景SVG内联合并到输出中；为 False 时只以 <image href> 引用背景文件 (客户端可自行加载)
+        self.embed_assets = data.get('embedAssets', True)
         
-        # Scan the fonts directory for custom fonts
-        fonts_dir = os.path.join(os.getcwd(), 'uploads', 'fonts')
-        if os.path.exists(fonts_dir):
-            for file in os.listdir(fonts_dir):
-                if file.lower().endswith(('.ttf', '.otf')):
-                    font_path = os.path.join(fonts_dir, file)
-                    font_family = os.path.splitext(file)[0]
-                    font_map[font_family] = font_path
-                    
-                    # Also register without hyphens if the name contains them
-                    if '-' in font_family:
-                        no_hyphen_name = font_family.replace('-', '')
-                        font_map[no_hyphen_name] = font_path
-                        
-                        # 对于 Montserrat 系列字体的特殊处理
-                        if font_family.startswith('Montserrat-'):
-                            # 将所有 Montserrat 变体注册为 Montserrat 字体
-                            font_map['Montserrat'] = font_path
+        # 可选视口：只输出视口内的内容，完全落在视口外的文本不再绘制
+        self.viewport = parse_viewport(data.get('viewport'))
         
-        # 简化日志输出
-        logger.debug(f"Available fonts: {list(font_map.keys())}")
+        # Prepare output directory
+        self.output_dir = os.path.join(os.getcwd(), 'uploads', 'stamps')
+        ensure_dir(self.output_dir)
         
-        return font_map
+        # Map font families to font files
+        self.font_map, self.font_map_ci = build_font_map(os.path.join(os.getcwd(), 'uploads', 'fonts'))
+
 
     def _get_font_path(self, font_family):
         """Get the font file path for a given font family"""
-        if font_family in self.font_map:
-            return self.font_map[font_family]
+        font_path = self.font_map.get(font_family)
+        if font_path:
+            return font_path
             
         # 尝试使用不区分大小写的匹配
-        for name in self.font_map:
-            if name.lower() == font_family.lower():
-                return self.font_map[name]
+        font_path = self.font_map_ci.get(font_family.lower())
+        if font_path:
+            return font_path
                     
         logger.warning(f"Font not found: {font_family}")
         return self.font_map.get('Arial')  # Default fallback
 
-    def _generate_svg_cairo(self):
-        """使用PyCairo和Pango生成SVG文件"""
+    def _resolve_elements(self):
+        """
+        预先解析所有文本元素的渲染属性 (合并模板属性、解析颜色、填充默认值)，不涉及Cairo调用
+        
+        Returns:
+            按原顺序排列的 (text, font_family, font_size, x, y, color, rotation, text_align, vert_align, element) 元组列表，
+            element 为原始元素 (渲染时直接读取圆形文本等属性，不再按文本内容反查)；
+            空文本和属性无效的元素被跳过。绘制顺序决定重叠文本的层次，因此不按字体重新排序
+        """
+        resolved = []
+        for element in self.text_elements:
+            try:
+                # 获取元素属性
+                text = element.get('value', '')
+                if not text:
+                    continue
+                
+                # 从模板元素获取字体属性(如果可用)
+                template_element = self.template_by_id.get(element.get('id'), {})
+                
+                font_family = element.get('fontFamily') or template_element.get('fontFamily', 'Arial')
+                font_size = element.get('fontSize') or template_element.get('fontSize', 16)
+                
+                # 获取位置
+                position = element.get('position') or template_element.get('position', {})
+                x = position.get('x', 10)
+                y = position.get('y', 10)
+                
+                # 获取颜色
+                color_str = element.get('color') or template_element.get('color', '#000000')
+                color = parse_hex_color(color_str)
+                
+                # 获取旋转
+                rotation = position.get('rotation', 0)
+                
+                # 获取文本对齐方式
+                text_align = position.get('textAlign', 'left')
+                vert_align = position.get('verticalAlign', 'baseline')
+                
+                resolved.append((text, font_family, font_size, x, y, color, rotation, text_align, vert_align, element))
+                
+            except Exception as e:
+                logger.error(f"Error drawing text: {e}")
+        return resolved
+
+    def _generate_svg_cairo(self, output=None):
+        """
+        使用PyCairo和uharfbuzz生成SVG文件
+        
+        Args:
+            output: SVG表面的输出目标 (文件路径或可写的二进制文件对象)。为 None 时写入内存并返回SVG字符串；
+                    指定时直接流式写入该文件，返回的内容为 None (不支持栅格化模式)
+        """
         try:
             # 创建一个临时文件用于SVG输出
-            svg_output = BytesIO()
+            svg_output = BytesIO() if output is None else output
             
-            # 创建一个SVG表面
-            surface = cairo.SVGSurface(svg_output, self.width, self.height)
+            # 小尺寸印章可选择栅格化：绘制到位图表面再嵌入SVG，省去SVG表面的字形嵌入开销
+            if self.rasterize_svg:
+                surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, int(self.width), int(self.height))
+            else:
+                # 创建一个SVG表面
+                surface = cairo.SVGSurface(svg_output, self.width, self.height)
             ctx = cairo.Context(surface)
+            
+            # 裁剪到视口，视口外的字形由Cairo直接丢弃
+            if self.viewport:
+                vx0, vy0, vx1, vy1 = self.viewport
+                ctx.rectangle(vx0, vy0, vx1 - vx0, vy1 - vy0)
+                ctx.clip()
 
-            # 绘制文本元素
-            for element in self.text_elements:
+            # 绘制文本元素 (属性已预先解析，循环内只调用渲染)
+            for resolved in self._resolve_elements():
                 try:
-                    # 获取元素属性
-                    text = element.get('value', '')
-                    if not text:
-                        continue
-                    
-                    # 从模板元素获取字体属性(如果可用)
-                    template_element = next((t for t in self.template.get('textElements', []) 
-                                           if t.get('id') == element.get('id')), {})
-                    
-                    font_family = element.get('fontFamily') or template_element.get('fontFamily', 'Arial')
-                    font_size = element.get('fontSize') or template_element.get('fontSize', 16)
-                    
-                    # 获取位置
-                    position = element.get('position') or template_element.get('position', {})
-                    x = position.get('x', 10)
-                    y = position.get('y', 10)
-                    
-                    # 获取颜色
-                    color_str = element.get('color') or template_element.get('color', '#000000')
-                    # 解析颜色字符串 (#RRGGBB 格式) 为 RGB 值 (0-1范围)
-                    color = (
-                        int(color_str[1:3], 16) / 255,
-                        int(color_str[3:5], 16) / 255,
-                        int(color_str[5:7], 16) / 255
-                    )
-                    
-                    # 获取旋转
-                    rotation = position.get('rotation', 0)
-                    
-                    # 获取文本对齐方式
-                    text_align = position.get('textAlign', 'left')
-                    vert_align = position.get('verticalAlign', 'baseline')
-                    
-                    # 使用Pango渲染文本以解决字母间距问题
-                    self._render_with_advanced_cairo(ctx, text, font_family, font_size, x, y, color, rotation, text_align, vert_align)
-                    
+                    # 使用uharfbuzz排版文本以解决字母间距问题
+                    self._render_with_advanced_cairo(ctx, *resolved)
                 except Exception as e:
                     logger.error(f"Error drawing text: {e}")
             
-            # 完成SVG表面
-            surface.finish()
-            
-            # 获取SVG内容
-            svg_content = svg_output.getvalue().decode('utf-8')
+            if self.rasterize_svg:
+                # 将位图以PNG形式嵌入最小的SVG外壳
+                surface.write_to_png(svg_output)
+                surface.finish()
+                encoded_png = b64encode_ascii(svg_output.getbuffer())
+                svg_content = (
+                    f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                    f'width="{self.width}" height="{self.height}">'
+                    f'<image width="{self.width}" height="{self.height}" '
+                    f'xlink:href="data:image/png;base64,{encoded_png}"/></svg>'
+                )
+            else:
+                # 完成SVG表面
+                surface.finish()
+                
+                if output is not None:
+                    # 已直接写入目标文件
+                    return None, None
+                
+                # 获取SVG内容，去掉标签间的空白以减小输出体积
+                svg_content = _INTER_TAG_WHITESPACE.sub(b'><', svg_output.getvalue()).decode('utf-8')
             
             # 简化的调试输出
-            logger.debug(f"Generated SVG: {len(svg_content)} bytes")
+            logger.debug("Generated SVG: %s bytes", len(svg_content))
             
             return svg_content, None
             
         except Exception as e:
             return None, f"Error generating SVG: {e}"
 
-    def _render_with_advanced_cairo(self, ctx, text, font_family, font_size, x, y, color, rotation, text_align, vert_align):
+    def _render_with_advanced_cairo(self, ctx, text, font_family, font_size, x, y, color, rotation, text_align, vert_align,
+                                    element=None):
         """使用uharfbuzz处理字体间距并使用Cairo渲染文本"""
         try:
             # 保存当前状态用于旋转
@@ -224,30 +574,32 @@ class StampGenerator:
             end_angle = 360
             direction = 'clockwise'
             baseline_position = 'inside'  # 新增参数，默认为内圈
+            position = {}
             
-            # 查找当前文本元素的属性
-            for element in self.text_elements:
-                if element.get('value') == text:
-                    position = element.get('position', {})
-                    circular_text = position.get('isCircular', False)
-                    if circular_text:
-                        radius = position.get('radius', 200)
-                        start_angle = position.get('startAngle', 0)
-                        end_angle = position.get('endAngle', 360)
-                        direction = position.get('direction', 'clockwise')
-                        baseline_position = position.get('baselinePosition', 'inside')  # 新增参数获取
-                    break
+            # 当前文本元素的属性 (由调用方直接传入，相同文本的多个元素各自使用自己的属性)
+            if element is not None:
+                position = element.get('position', {})
+                circular_text = position.get('isCircular', False)
+                if circular_text:
+                    radius = position.get('radius', 200)
+                    start_angle = position.get('startAngle', 0)
+                    end_angle = position.get('endAngle', 360)
+                    direction = position.get('direction', 'clockwise')
+                    baseline_position = position.get('baselinePosition', 'inside')  # 新增参数获取
             
             # 如果是普通文本，按照原来的方式处理
             if not circular_text:
                 # 旋转 (如果需要)
                 if rotation:
-                    # 移动到旋转中心
-                    ctx.translate(x, y)
-                    # 旋转 (需要转换为弧度)
-                    ctx.rotate(rotation * (math.pi / 180.0))
-                    # 重置位置为原点
-                    ctx.translate(-x, -y)
+                    # 绕 (x, y) 旋转：将 平移-旋转-反平移 合并为一个仿射矩阵
+                    rot_rad = math.radians(rotation)
+                    cos_r = math.cos(rot_rad)
+                    sin_r = math.sin(rot_rad)
+                    ctx.transform(cairo.Matrix(
+                        cos_r, sin_r, -sin_r, cos_r,
+                        x - x * cos_r + y * sin_r,
+                        y - x * sin_r - y * cos_r
+                    ))
             
             # 获取字体文件路径
             font_path = self._get_font_path(font_family)
@@ -255,47 +607,20 @@ class StampGenerator:
             # 设置颜色
             ctx.set_source_rgb(color[0], color[1], color[2])
             
+            # 简单文本快速路径：跳过HarfBuzz排版，直接由Cairo渲染
+            if self.fast_path and is_simple_text(text):
+                self._render_basic(ctx, text, font_family, font_size, x, y, rotation, text_align, vert_align,
+                                   circular_text, radius, position)
+                ctx.restore()
+                return
+            
             # 使用uharfbuzz进行排版
             try:
-                # 从缓存中获取uharfbuzz字体对象，如果不存在则创建
-                hb_font_key = (font_path, font_size)
-                if hb_font_key not in self.hb_fonts:
-                    # 创建blob和face
-                    blob = hb.Blob.from_file_path(font_path)
-                    face = hb.Face(blob)
-                    
-                    # 创建字体
-                    font = hb.Font(face)
-                    
-                    # 设置缩放比例 (uharfbuzz自动处理缩放)
-                    font.scale = (int(font_size * 64), int(font_size * 64))
-                    
-                    # 存入缓存
-                    self.hb_fonts[hb_font_key] = font
-                else:
-                    font = self.hb_fonts[hb_font_key]
+                # 当圆形文本的baseline在外时，需要反转文本顺序和调整起始角度；只排版实际渲染的文本
+                source_text = text[::-1] if circular_text and baseline_position == 'outside' else text
                 
-                # 创建Buffer
-                buf = hb.Buffer()
-                
-                # 添加文本
-                buf.add_str(text)
-                
-                # 设置buffer属性
-                buf.direction = "ltr"  # 从左到右
-                buf.script = "Latn"    # 拉丁文
-                buf.language = "en"    # 英语
-                
-                # 应用字体排版 - 启用kerning
-                features = {"kern": True, "liga": True}  # 启用字偶距和连字
-                hb.shape(font, buf, features)
-                
-                # 获取排版信息
-                infos = buf.glyph_infos
-                positions = buf.glyph_positions
-                
-                # 计算整体宽度用于对齐
-                total_width = sum(pos.x_advance for pos in positions) / 64.0
+                # 排版结果按 (字体, 字号, 文本) 缓存
+                glyphs, total_width = shape_text(font_path, font_size, source_text)
                 
                 # 如果是圆形文本，计算每个字符的间距角度
                 if circular_text:
@@ -303,21 +628,6 @@ class StampGenerator:
                     base_angle = position.get('baseAngle', 0)
                     letter_spacing = position.get('letterSpacing', 1.0)  # 新增字符间距调整参数
                     
-                    # 当baseline在外时，需要反转文本顺序和调整起始角度
-                    if baseline_position == 'outside':
-                        reversed_text = text[::-1]
-                        buf = hb.Buffer()
-                        buf.add_str(reversed_text)
-                        buf.direction = "ltr"
-                        buf.script = "Latn"
-                        buf.language = "en"
-                        hb.shape(font, buf, features)
-                        infos = buf.glyph_infos
-                        positions = buf.glyph_positions
-                        
-                        # 重新计算总宽度
-                        total_width = sum(pos.x_advance for pos in positions) / 64.0
-                    
                     # 计算圆弧总长度和分布比例
                     circumference = 2 * math.pi * radius  # 圆周长
                     text_length = total_width  # 文本总宽度
@@ -346,7 +656,7 @@ class StampGenerator:
                     
                     # 文本总占用角度（弧度）
                     total_angle_rad = (text_length / radius) * spacing_factor
-                    total_angle_deg = total_angle_rad * (180 / math.pi)
+                    total_angle_deg = total_angle_rad * RAD_TO_DEG
                     
                     # 根据不同对齐模式确定起始角度
                     if layout_mode == 'centerAligned':
@@ -354,85 +664,67 @@ class StampGenerator:
                     else:
                         start_angle = base_angle
                     
-                    # 当前角度
-                    current_angle = start_angle
-                    current_pos = 0  # 追踪文本当前位置
-                    
-                    # 预先计算每个字符的位置和角度
-                    char_positions = []
-                    
-                    for i, (info, pos) in enumerate(zip(infos, positions)):
-                        x_advance = pos.x_advance / 64.0
-                        
-                        # 计算这个字符占用的角度（考虑间距因子）
-                        char_angle_rad = (x_advance / radius) * spacing_factor
-                        char_angle_deg = char_angle_rad * (180 / math.pi)
-                        
-                        # 计算字符的中心位置角度
-                        char_half_angle = char_angle_deg / 2
-                        center_angle_deg = current_angle + char_half_angle
-                        center_angle_rad = center_angle_deg * (math.pi / 180.0)
-                        
-                        # 保存字符位置信息
-                        char_positions.append({
-                            'info': info,
-                            'pos': pos,
-                            'center_angle_rad': center_angle_rad,
-                            'angle_deg': char_angle_deg,
-                            'x_advance': x_advance
-                        })
-                        
-                        # 更新当前角度
-                        current_angle += char_angle_deg
-                        current_pos += x_advance
+                    # 以数组一次性计算每个字符占用的角度（考虑间距因子）
+                    x_advances = np.fromiter((glyph[4] for glyph in glyphs), dtype=np.float64, count=len(glyphs))
+                    char_angles_deg = x_advances * (spacing_factor * RAD_TO_DEG / radius)
                     
                     # 根据总的角度分布，微调每个字符的位置，使其更加均匀
-                    total_actual_angle = current_angle - start_angle
+                    total_actual_angle = char_angles_deg.sum()
                     if total_actual_angle > 10:  # 只有在角度足够大时才进行调整
-                        adjustment_ratio = total_angle_deg / total_actual_angle
-                        
-                        # 应用调整
-                        current_angle = start_angle
-                        for char_pos in char_positions:
-                            char_pos['angle_deg'] *= adjustment_ratio
-                            char_pos['center_angle_rad'] = (current_angle + char_pos['angle_deg']/2) * (math.pi / 180.0)
-                            current_angle += char_pos['angle_deg']
+                        char_angles_deg *= total_angle_deg / total_actual_angle
+                    
+                    # 字符中心角度 = 起始角度 + 之前所有字符的角度 + 自身角度的一半
+                    center_angles_rad = (start_angle + np.cumsum(char_angles_deg) - char_angles_deg / 2) * DEG_TO_RAD
+                    
+                    # 计算字符在圆上的位置
+                    cos_a = np.cos(center_angles_rad)
+                    sin_a = np.sin(center_angles_rad)
+                    glyph_xs = (x + radius * cos_a).tolist()
+                    glyph_ys = (y + radius * sin_a).tolist()
+                    
+                    # 字符旋转角度为中心角度 + 90° (外侧基线再转 180°)，其正余弦可由中心角度的正余弦直接得到
+                    if baseline_position == 'outside':
+                        rotation_cos, rotation_sin = sin_a.tolist(), (-cos_a).tolist()
+                    else:
+                        rotation_cos, rotation_sin = (-sin_a).tolist(), cos_a.tolist()
+                    
+                    # 设置字体 (save/restore 之间保持不变，无需逐字符重新设置)
+                    scaled_font = get_scaled_font(font_family, font_size, nominal=True)
+                    ctx.set_scaled_font(scaled_font)
+                    
+                    # 与直线文本相同：由Cairo一次性把原文映射为自身的字形编号，逐字符以 show_glyphs 输出，
+                    # 不再对每个字符走 show_text 的文本 -> 字形转换
+                    cairo_glyphs = scaled_font.text_to_glyphs(0, 0, source_text, False)
+                    
+                    # 字形宽度只与字体和字形有关，重复出现的字形只测量一次
+                    glyph_widths = {}
+                    
+                    # 每个字形直接设置 "平移到圆周位置并旋转" 的完整变换矩阵，
+                    # 代替逐字符的 save/translate/rotate/restore，循环结束后恢复原矩阵
+                    base_matrix = ctx.get_matrix()
                     
                     # 渲染每个字符
-                    for char_pos in char_positions:
-                        info = char_pos['info']
-                        pos = char_pos['pos']
-                        angle_rad = char_pos['center_angle_rad']
-                        
-                        # 计算字符在圆上的位置
-                        glyph_x = x + radius * math.cos(angle_rad)
-                        glyph_y = y + radius * math.sin(angle_rad)
-                        
-                        ctx.save()
-                        ctx.translate(glyph_x, glyph_y)
-                        
-                        # 计算字符旋转角度
-                        rotation_angle = angle_rad + (math.pi / 2)
-                        if baseline_position == 'outside':
-                            rotation_angle += math.pi
+                    for glyph, glyph_x, glyph_y, cos_r, sin_r in zip(glyphs, glyph_xs, glyph_ys,
+                                                                     rotation_cos, rotation_sin):
+                        # 根据字符簇找到原始字符对应的Cairo字形 (超出原文范围的字形按空格处理，不输出)
+                        cluster = glyph[1]
+                        if cluster >= len(cairo_glyphs):
+                            continue
+                        glyph_index = cairo_glyphs[cluster].index
                         
-                        ctx.rotate(rotation_angle)
+                        # 获取字形宽度
+                        glyph_width = glyph_widths.get(glyph_index)
+                        if glyph_width is None:
+                            glyph_width = glyph_widths[glyph_index] = \
+                                scaled_font.glyph_extents([cairo.Glyph(glyph_index, 0, 0)]).width
                         
-                        # 设置字体
-                        ctx.select_font_face(font_family, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-                        ctx.set_font_size(font_size)
+                        # 先旋转、再平移到圆周位置，最后叠加原有变换 (等价于 translate + rotate)
+                        ctx.set_matrix(cairo.Matrix(cos_r, sin_r, -sin_r, cos_r, glyph_x, glyph_y).multiply(base_matrix))
                         
-                        # 获取字符
-                        cluster = info.cluster
-                        source_text = reversed_text if baseline_position == 'outside' else text
-                        glyph_char = source_text[cluster] if cluster < len(source_text) else ' '
-                        
-                        # 获取字符宽度并居中渲染
-                        char_extents = ctx.text_extents(glyph_char)
-                        ctx.move_to(-char_extents.width / 2, 0)
-                        ctx.show_text(glyph_char)
-                        
-                        ctx.restore()
+                        # 居中渲染
+                        ctx.show_glyphs([cairo.Glyph(glyph_index, -glyph_width / 2, 0)])
+                    
+                    ctx.set_matrix(base_matrix)
                 else:
                     # 获取可用宽度 - 根据旋转计算
                     padding = 50 # TODO 这里需要改成配置式或者根据字体大小自动计算
@@ -448,30 +740,14 @@ class StampGenerator:
                         scale_factor = max_available_width / total_width
                         # 应用缩放到字体大小
                         font_size = font_size * scale_factor
-                        logger.debug(f"Scaling text '{text}' by factor {scale_factor}")
+                        logger.debug("Scaling text '%s' by factor %s", text, scale_factor)
                         
-                        # 创建新的scaled字体
-                        if scale_factor < 1.0:
-                            # 创建新的字体对象
-                            blob = hb.Blob.from_file_path(font_path)
-                            face = hb.Face(blob)
-                            font = hb.Font(face)
-                            font.scale = (int(font_size * 64), int(font_size * 64))
-                            
-                            # 重新排版
-                            buf = hb.Buffer()
-                            buf.add_str(text)
-                            buf.direction = "ltr"
-                            buf.script = "Latn"
-                            buf.language = "en"
-                            hb.shape(font, buf, features)
-                            
-                            # 更新信息
-                            infos = buf.glyph_infos
-                            positions = buf.glyph_positions
-                            
-                            # 重新计算总宽度
-                            total_width = sum(pos.x_advance for pos in positions) / 64.0
+                        # 字形位置与字号成正比，按比例缩放原排版结果，不再以新字号重新排版
+                        glyphs = tuple(
+                            (codepoint, cluster, glyph_x * scale_factor, glyph_y * scale_factor, x_advance * scale_factor)
+                            for codepoint, cluster, glyph_x, glyph_y, x_advance in glyphs
+                        )
+                        total_width = max_available_width
                     
                     # 计算定位
                     place_x = x
@@ -483,173 +759,54 @@ class StampGenerator:
                     elif text_align == 'right':
                         place_x = x - total_width
                     
-                    # 计算垂直位置，需要字体的度量信息
-                    ctx.select_font_face(font_family, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-                    ctx.set_font_size(font_size)
-                    font_extents = ctx.font_extents()
+                    scaled_font = get_scaled_font(font_family, font_size, nominal=scale_factor == 1.0)
+                    ctx.set_scaled_font(scaled_font)
+                    
+                    # 计算垂直位置 (extents 返回 (ascent, descent, ...) 元组)；
+                    # 默认的基线对齐和不做视口检查时不需要字体度量
+                    check_viewport = self.viewport and not rotation
+                    if vert_align in ('top', 'middle') or check_viewport:
+                        ascent, descent = scaled_font.extents()[:2]
                     
                     # 垂直对齐
                     if vert_align == 'top':
-                        place_y = y + font_extents.ascent
+                        place_y = y + ascent
                     elif vert_align == 'middle':
-                        place_y = y + (font_extents.ascent - font_extents.descent) / 2
+                        place_y = y + (ascent - descent) / 2
                     # baseline 是默认
                     
+                    # 未旋转的文本在视口外时整段跳过 (包围盒：前进宽度 x 字体上下界)
+                    if check_viewport:
+                        vx0, vy0, vx1, vy1 = self.viewport
+                        if place_x + total_width < vx0 or place_x > vx1 or \
+                                place_y + descent < vy0 or place_y - ascent > vy1:
+                            logger.debug("Skipping '%s' outside viewport", text)
+                            ctx.restore()
+                            return
+                    
                     # 简化调试输出
-                    logger.debug(f"Rendering '{text}' at ({place_x:.1f}, {place_y:.1f})")
-                    
-                    # 使用Cairo渲染每个字形
-                    current_x = place_x
-                    current_y = place_y
-                    
-                    # 创建字体上下文用于后续渲染
-                    ctx.select_font_face(font_family, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-                    ctx.set_font_size(font_size)
-                    
-                    # 遍历所有字形并渲染
-                    for i, (info, pos) in enumerate(zip(infos, positions)):
-                        # 获取字符
-                        # uharfbuzz不提供直接的字形到字符串的转换，所以我们使用原始字符
-                        # 我们从文本的字符簇信息中获取对应的字符
-                        cluster = info.cluster
-                        # 根据字符簇找到原始字符（这里简化处理，可能对复杂文本不够准确）
-                        glyph_char = text[cluster] if cluster < len(text) else ' '
-                        
-                        # 获取位置偏移 (需要转换单位)
-                        x_offset = pos.x_offset / 64.0
-                        y_offset = pos.y_offset / 64.0
-                        x_advance = pos.x_advance / 64.0
-                        
-                        # 移动到绘制位置
-                        glyph_x = current_x + x_offset
-                        glyph_y = current_y - y_offset
-                        
-                        # 渲染字符
-                        ctx.move_to(glyph_x, glyph_y)
-                        ctx.show_text(glyph_char)
-                        
-                        # 更新位置
-                        current_x += x_advance
+                    logger.debug("Rendering '%s' at (%.1f, %.1f)", text, place_x, place_y)
+                    
+                    # Cairo 字体与HarfBuzz所用字体文件的字形编号不一定一致，
+                    # 因此由Cairo一次性把原文映射为自身的字形编号，位置则沿用HarfBuzz的排版结果
+                    cairo_glyphs = scaled_font.text_to_glyphs(0, 0, text, False)
+                    
+                    # 收集所有字形，最后一次性渲染
+                    # 根据字符簇找到原始字符对应的Cairo字形（这里简化处理，可能对复杂文本不够准确）
+                    cairo_glyph_count = len(cairo_glyphs)
+                    glyph_run = [
+                        cairo.Glyph(cairo_glyphs[cluster].index, place_x + glyph_x, place_y + glyph_y)
+                        for _, cluster, glyph_x, glyph_y, _ in glyphs
+                        if cluster < cairo_glyph_count
+                    ]
+                    
+                    ctx.show_glyphs(glyph_run)
                 
             except Exception as hb_error:
                 logger.warning(f"Using basic rendering: {hb_error}")
                 # 回退到基本的渲染
-                ctx.select_font_face(font_family, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-                ctx.set_font_size(font_size)
-                
-                # 检查是否为圆形文本
-                if circular_text:
-                    # 计算字体路径
-                    layout_mode = position.get('layoutMode', 'startAligned')  # 默认为起点对齐模式
-                    base_angle = position.get('baseAngle', 0)  # 基准角度，默认为0度（正上方）
-                    
-                    # 计算所有字符的总宽度
-                    total_width = 0
-                    for char in text:
-                        char_extents = ctx.text_extents(char)
-                        total_width += char_extents.x_advance
-                    
-                    # 计算总弧度（弧度 = 文本总宽度/半径）
-                    total_angle = (total_width / radius) * (180 / math.pi)
-                    
-                    # 根据不同对齐模式确定起始角度
-                    if layout_mode == 'centerAligned':
-                        # 中心对齐模式：以base_angle为中心，向两侧均匀分布
-                        # 计算整体文本角度宽度
-                        total_text_angle = sum(pos.x_advance / 64.0 for pos in positions) / radius * (180 / math.pi)
-                        # 修正：从base_angle减去半个文本宽度作为起始角度
-                        start_angle = (base_angle - total_text_angle/2) % 360
-                    else:
-                        # 起点对齐模式：从base_angle开始
-                        start_angle = base_angle
-                    
-                    # 当前角度
-                    current_angle = start_angle
-                    
-                    # 渲染每个字符
-                    for i, char in enumerate(text):
-                        # 获取当前字符的宽度
-                        char_extents = ctx.text_extents(char)
-                        char_advance = char_extents.x_advance
-                        
-                        # 计算字符在圆上的位置 (使用当前角度 + 字符宽度的一半，让字符居中)
-                        char_half_angle = (char_advance / 2 / radius) * (180 / math.pi)
-                        angle_rad = (current_angle + char_half_angle) * (math.pi / 180.0)
-                        
-                        # 计算字符在圆上的x,y坐标
-                        glyph_x = x + radius * math.cos(angle_rad)
-                        glyph_y = y + radius * math.sin(angle_rad)
-                        
-                        # 保存状态以便旋转
-                        ctx.save()
-                        
-                        # 移动到字符位置
-                        ctx.translate(glyph_x, glyph_y)
-                        
-                        # 计算字符旋转角度
-                        rotation_angle = angle_rad + (math.pi / 2)
-                        
-                        # 应用旋转
-                        ctx.rotate(rotation_angle)
-                        
-                        # 确保每个字符都使用正确的字体和大小
-                        ctx.select_font_face(font_family, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-                        ctx.set_font_size(font_size)
-                        
-                        # 渲染字符 (居中)
-                        ctx.move_to(-char_extents.width / 2, 0)
-                        ctx.show_text(char)
-                        
-                        # 恢复状态
-                        ctx.restore()
-                        
-                        # 更新角度为下一个字符 (当前字符宽度对应的角度)
-                        char_angle = (char_advance / radius) * (180 / math.pi)
-                        current_angle += char_angle
-                else:
-                    # 获取文本尺寸
-                    text_extents = ctx.text_extents(text)
-                    text_width = text_extents.width
-                    
-                    # 检查文本是否超出可用空间并缩放
-                    max_available_width = self.width
-                    if rotation % 180 != 0:
-                        if rotation % 180 > 45 and rotation % 180 < 135:
-                            max_available_width = self.height
-                    
-                    # 如果宽度超出，缩放字体大小
-                    if text_width > max_available_width:
-                        scale_factor = max_available_width / text_width
-                        font_size = font_size * scale_factor
-                        logger.debug(f"Basic scaling by factor {scale_factor}")
-                        
-                        # 更新字体大小
-                        ctx.set_font_size(font_size)
-                        
-                        # 重新计算尺寸
-                        text_extents = ctx.text_extents(text)
-                        text_width = text_extents.width
-                    
-                    # 计算定位
-                    place_x = x
-                    place_y = y
-                    
-                    # 水平对齐
-                    if text_align == 'center':
-                        place_x = x - (text_width / 2)
-                    elif text_align == 'right':
-                        place_x = x - text_width
-                    
-                    # 垂直对齐
-                    font_extents = ctx.font_extents()
-                    if vert_align == 'top':
-                        place_y = y + font_extents.ascent
-                    elif vert_align == 'middle':
-                        place_y = y + (font_extents.ascent - font_extents.descent) / 2
-                    
-                    # 简单渲染文本
-                    ctx.move_to(place_x, place_y)
-                    ctx.show_text(text)
+                self._render_basic(ctx, text, font_family, font_size, x, y, rotation, text_align, vert_align,
+                                   circular_text, radius, position)
             
             # 恢复旋转前的状态
             ctx.restore()
@@ -659,23 +816,153 @@ class StampGenerator:
             # 回退到最基本的文本渲染
             ctx.save()
             ctx.set_source_rgb(color[0], color[1], color[2])
-            ctx.select_font_face(font_family, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-            ctx.set_font_size(font_size)
+            ctx.set_scaled_font(get_scaled_font(font_family, font_size, nominal=True))
             ctx.move_to(x, y)
             ctx.show_text(text)
             ctx.restore()
 
+    def _render_basic(self, ctx, text, font_family, font_size, x, y, rotation, text_align, vert_align,
+                      circular_text, radius, position):
+        """不经过HarfBuzz，直接使用Cairo的 text_extents/show_text 渲染文本"""
+        # 与HarfBuzz路径共用缓存的缩放字体，一次调用同时设置字体和字号
+        ctx.set_scaled_font(get_scaled_font(font_family, font_size, nominal=True))
+        
+        # 检查是否为圆形文本
+        if circular_text:
+            # 计算字体路径
+            layout_mode = position.get('layoutMode', 'startAligned')  # 默认为起点对齐模式
+            base_angle = position.get('baseAngle', 0)  # 基准角度，默认为0度（正上方）
+            
+            # 计算所有字符的总宽度 (每个不同字符只测量一次，下面逐字符放置时复用)
+            extents_by_char = {}
+            total_width = 0
+            for char in text:
+                char_extents = extents_by_char.get(char)
+                if char_extents is None:
+                    char_extents = extents_by_char[char] = ctx.text_extents(char)
+                total_width += char_extents.x_advance
+            
+            # 计算总弧度（弧度 = 文本总宽度/半径）
+            total_angle = (total_width / radius) * RAD_TO_DEG
+            
+            # 根据不同对齐模式确定起始角度
+            if layout_mode == 'centerAligned':
+                # 中心对齐模式：以base_angle为中心，向两侧均匀分布
+                # 计算整体文本角度宽度
+                total_text_angle = total_width / radius * RAD_TO_DEG
+                # 修正：从base_angle减去半个文本宽度作为起始角度
+                start_angle = (base_angle - total_text_angle/2) % 360
+            else:
+                # 起点对齐模式：从base_angle开始
+                start_angle = base_angle
+            
+            # 当前角度
+            current_angle = start_angle
+            
+            # 渲染每个字符
+            for i, char in enumerate(text):
+                # 获取当前字符的宽度
+                char_extents = extents_by_char[char]
+                char_advance = char_extents.x_advance
+                
+                # 计算字符在圆上的位置 (使用当前角度 + 字符宽度的一半，让字符居中)
+                char_half_angle = (char_advance / 2 / radius) * RAD_TO_DEG
+                angle_rad = (current_angle + char_half_angle) * DEG_TO_RAD
+                
+                # 计算字符在圆上的x,y坐标
+                glyph_x = x + radius * math.cos(angle_rad)
+                glyph_y = y + radius * math.sin(angle_rad)
+                
+                # 保存状态以便旋转
+                ctx.save()
+                
+                # 移动到字符位置
+                ctx.translate(glyph_x, glyph_y)
+                
+                # 计算字符旋转角度
+                rotation_angle = angle_rad + (math.pi / 2)
+                
+                # 应用旋转
+                ctx.rotate(rotation_angle)
+                
+                # 渲染字符 (居中)
+                ctx.move_to(-char_extents.width / 2, 0)
+                ctx.show_text(char)
+                
+                # 恢复状态
+                ctx.restore()
+                
+                # 更新角度为下一个字符 (当前字符宽度对应的角度)
+                char_angle = (char_advance / radius) * RAD_TO_DEG
+                current_angle += char_angle
+        else:
+            # 获取文本尺寸
+            text_extents = ctx.text_extents(text)
+            text_width = text_extents.width
+            
+            # 检查文本是否超出可用空间并缩放
+            max_available_width = self.width
+            if rotation % 180 != 0:
+                if rotation % 180 > 45 and rotation % 180 < 135:
+                    max_available_width = self.height
+            
+            # 如果宽度超出，缩放字体大小
+            if text_width > max_available_width:
+                scale_factor = max_available_width / text_width
+                font_size = font_size * scale_factor
+                logger.debug("Basic scaling by factor %s", scale_factor)
+                
+                # 更新字体大小
+                ctx.set_scaled_font(get_scaled_font(font_family, font_size))
+                
+                # 重新计算尺寸
+                text_extents = ctx.text_extents(text)
+                text_width = text_extents.width
+            
+            # 计算定位
+            place_x = x
+            place_y = y
+            
+            # 水平对齐
+            if text_align == 'center':
+                place_x = x - (text_width / 2)
+            elif text_align == 'right':
+                place_x = x - text_width
+            
+            # 垂直对齐 (基线对齐时不需要字体度量)
+            if vert_align == 'top':
+                place_y = y + ctx.font_extents()[0]
+            elif vert_align == 'middle':
+                ascent, descent = ctx.font_extents()[:2]
+                place_y = y + (ascent - descent) / 2
+            
+            # 简单渲染文本
+            ctx.move_to(place_x, place_y)
+            ctx.show_text(text)
+
     def generate(self):
         """Generate the stamp in SVG format"""
-        # 只使用Cairo/Pango生成SVG
+        return self._generate()
+
+    def _generate(self, as_bytes=False):
+        """
+        生成SVG，as_bytes 为 True 时返回UTF-8字节
+
+        合并背景时，字节结果直接拼接缓存的背景字节，不再对整个背景重新编码
+        """
+        # 只使用Cairo生成SVG
         data, error = self._generate_svg_cairo()
         if error:
-            # 如果出现异常，尝试回退到svgwrite方法 (如果保留了该方法)
             logger.error(f"SVG generation error: {error}")
             return None, error
             
+        # 不内联背景时只插入引用，省去读取和合并背景SVG
+        if self._has_svg_background() and not self.embed_assets:
+            data = self._link_background(data)
+            return (data.encode('utf-8') if as_bytes else data), None
+        
         # 如果有背景SVG，进行后期处理合并
-        if self.background_image_path and self.background_image_path.lower().endswith('.svg'):
+        if self._has_svg_background():
             try:
                 # SECURITY: Validate path to prevent path traversal attacks
                 allowed_bg_dir = os.path.join(os.getcwd(), 'uploads', 'backgrounds')
@@ -686,18 +973,20 @@ class StampGenerator:
             
             if full_bg_path and os.path.exists(full_bg_path):
                 try:
-                    # 读取背景SVG
-                    with open(full_bg_path, 'r') as f:
-                        bg_svg = f.read()
-                        
+                    # 读取并拆分背景SVG的根元素属性和内容 (按文件修改时间缓存)
+                    (bg_parts, bg_content_bytes, bg_namespaces, bg_used_namespaces,
+                     bg_width, bg_height) = load_svg_background(full_bg_path, os.stat(full_bg_path).st_mtime_ns)
+                    
                     # 读取生成的SVG
                     svg_content = data
                     
-                    # 提取背景SVG的基本信息
-                    bg_width_match = re.search(r'width="([^"]*)"', bg_svg)
-                    bg_height_match = re.search(r'height="([^"]*)"', bg_svg)
-                    bg_width = float(bg_width_match.group(1)) if bg_width_match else self.width
-                    bg_height = float(bg_height_match.group(1)) if bg_height_match else self.height
+                    bg_content = bg_parts[1] if bg_parts else None
+                    
+                    # 背景SVG根元素上的宽高 (随背景缓存)，缺失时按画布尺寸处理
+                    if bg_width is None:
+                        bg_width = self.width
+                    if bg_height is None:
+                        bg_height = self.height
                     
                     # 计算背景缩放和居中位置
                     target_width = self.width
@@ -717,73 +1006,102 @@ class StampGenerator:
                     # 创建用于背景的变换参数
                     transform = f'translate({x_offset},{y_offset}) scale({scale})'
                     
-                    # 从背景SVG中提取根元素属性
-                    bg_svg_attrs_match = re.search(r'<svg([^>]*)>', bg_svg, re.DOTALL)
-                    bg_svg_attrs = bg_svg_attrs_match.group(1) if bg_svg_attrs_match else ""
-                    
-                    # 从生成的SVG中提取内容部分 (在<svg>和</svg>之间)
-                    content_match = re.search(r'<svg[^>]*>(.*?)</svg>', svg_content, re.DOTALL)
-                    if content_match:
-                        content = content_match.group(1)
-                        
-                        # 从生成的SVG中提取命名空间和其他属性
-                        content_attrs_match = re.search(r'<svg([^>]*)>', svg_content, re.DOTALL)
-                        content_attrs = content_attrs_match.group(1) if content_attrs_match else ""
+                    # 从生成的SVG中提取根元素属性和内容部分 (在<svg>和</svg>之间)
+                    content_parts = split_svg(svg_content)
+                    if content_parts:
+                        content_attrs, content = content_parts
                         
                         # 合并两个SVG的属性，确保所有命名空间都被包含
-                        # 定义可能需要的命名空间
-                        namespaces = {
-                            'xmlns': 'http://www.w3.org/2000/svg',
-                            'xmlns:xlink': 'http://www.w3.org/1999/xlink', 
-                            'xmlns:svg': 'http://www.w3.org/2000/svg',
-                            'xmlns:sodipodi': 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd',
-                            'xmlns:inkscape': 'http://www.inkscape.org/namespaces/inkscape'
-                        }
+                        # (背景的命名空间和前缀扫描随背景一起缓存，这里只扫描生成的内容)
+                        existing_namespaces = dict(bg_namespaces)
+                        existing_namespaces.update(extract_svg_namespaces(content_attrs))
+                        used_namespaces = bg_used_namespaces | used_svg_namespaces(content)
                         
-                        # 从背景和内容属性中提取现有的命名空间
-                        existing_namespaces = {}
-                        for attr_str in [bg_svg_attrs, content_attrs]:
-                            for ns, uri in namespaces.items():
-                                ns_match = re.search(rf'{ns}="([^"]*)"', attr_str)
-                                if ns_match:
-                                    existing_namespaces[ns] = ns_match.group(1)
-                                    
-                        # 合并所有命名空间和宽高属性
-                        merged_attrs = ""
-                        for ns, uri in namespaces.items():
+                        merged_attrs = []
+                        for ns, uri in SVG_NAMESPACES.items():
                             if ns in existing_namespaces:
-                                merged_attrs += f' {ns}="{existing_namespaces[ns]}"'
-                            elif (ns == 'xmlns:xlink' and 'xlink:href' in bg_svg + content) or \
-                                 (ns == 'xmlns:sodipodi' and 'sodipodi:' in bg_svg + content) or \
-                                 (ns == 'xmlns:inkscape' and 'inkscape:' in bg_svg + content) or \
-                                 (ns == 'xmlns' or ns == 'xmlns:svg'):
-                                merged_attrs += f' {ns}="{uri}"'
+                                merged_attrs.append(f' {ns}="{existing_namespaces[ns]}"')
+                            elif ns in used_namespaces or ns == 'xmlns' or ns == 'xmlns:svg':
+                                merged_attrs.append(f' {ns}="{uri}"')
                         
                         # 添加宽度和高度属性
-                        merged_attrs += f' width="{self.width}" height="{self.height}"'
+                        merged_attrs.append(f' width="{self.width}" height="{self.height}"')
                         
-                        # 使用提取的内容创建一个新的SVG
-                        merged_svg = f'<svg{merged_attrs}>'
+                        # 按顺序收集片段后一次拼接，大段的背景内容只复制一次
+                        parts = [f'<svg{"".join(merged_attrs)}>']
                         
-                        # 将背景内容放入一个g元素中并应用变换
-                        bg_content_match = re.search(r'<svg[^>]*>(.*?)</svg>', bg_svg, re.DOTALL)
-                        if bg_content_match:
-                            bg_content = bg_content_match.group(1)
-                            # 将背景包装在g元素中并应用变换以实现居中和填充
-                            merged_svg += f'<g transform="{transform}">{bg_content}</g>'
+                        # 将背景内容放入一个g元素中并应用变换以实现居中和填充 (字节结果直接使用缓存的背景字节)
+                        if bg_content is not None:
+                            parts += (f'<g transform="{transform}">', bg_content_bytes if as_bytes else bg_content, '</g>')
                         
                         # 添加生成的SVG内容和关闭标签
-                        merged_svg += f'{content}</svg>'
+                        parts += (content, '</svg>')
+                        
+                        if as_bytes:
+                            return b''.join(part if isinstance(part, bytes) else part.encode('utf-8')
+                                            for part in parts), None
                         
                         # 使用合并后的SVG
-                        data = merged_svg
+                        data = ''.join(parts)
                     else:
                         logger.warning("Could not extract content from generated SVG")
                 except Exception as e:
                     logger.error(f"Error merging SVG with background: {e}")
                     # 继续使用原始生成的SVG
         
-        return data, None
+        return (data.encode('utf-8') if as_bytes else data), None
+
+    def generate_bytes(self):
+        """
+        生成SVG并返回UTF-8编码的字节
+
+        无需合并背景、也不栅格化时，直接取SVG表面写出的字节，不经过解码为字符串再重新编码；
+        合并背景时拼接缓存的背景字节
+        """
+        if self.rasterize_svg or self._has_svg_background():
+            return self._generate(as_bytes=True)
+        
+        svg_output = BytesIO()
+        _, error = self._generate_svg_cairo(output=svg_output)
+        if error:
+            logger.error(f"SVG generation error: {error}")
+            return None, error
+        
+        # 去掉标签间的空白以减小输出体积 (与 generate() 的结果一致)
+        return _INTER_TAG_WHITESPACE.sub(b'><', svg_output.getvalue()), None
+
+    def _link_background(self, svg_content):
+        """
+        在生成的SVG中插入引用背景文件的 <image> 元素 (位于文本之下)
+
+        xMidYMid slice 与内联合并时的 "按较大比例缩放并居中" 效果一致
+        """
+        try:
+            # SECURITY: Validate path to prevent path traversal attacks
+            allowed_bg_dir = os.path.join(os.getcwd(), 'uploads', 'backgrounds')
+            full_bg_path = validate_path(self.background_image_path, allowed_bg_dir)
+        except ValueError as e:
+            logger.warning(f"Invalid background image path: {self.background_image_path} - {e}")
+            return svg_content
+        
+        open_match = _SVG_OPEN_TAG.search(svg_content)
+        if not open_match:
+            logger.warning("Could not extract content from generated SVG")
+            return svg_content
+        
+        # html 只在不内联背景时用到，按需导入
+        import html
+        
+        href = '/' + os.path.relpath(full_bg_path, os.getcwd()).replace(os.sep, '/')
+        image = (
+            f'<image href="{html.escape(href)}" width="{self.width}" height="{self.height}" '
+            f'preserveAspectRatio="xMidYMid slice"/>'
+        )
+        return svg_content[:open_match.end()] + image + svg_content[open_match.end():]
+
+    def _has_svg_background(self):
+        """是否需要与背景SVG合并"""
+        return bool(self.background_image_path) and self.background_image_path.lower().endswith('.svg')
 
     def save_to_file(self, filename=None):
         """Save the generated stamp to a file"""
@@ -792,50 +1110,171 @@ class StampGenerator:
             timestamp = int(time.time())
             filename = f"stamp_{timestamp}.svg"
         
-        # Generate the stamp
-        data, error = self.generate()
+        output_path = os.path.join(self.output_dir, filename)
+        
+        # .svgz 文件名表示以 gzip 压缩写入 (gzip 只在此时导入)
+        compressed = filename.lower().endswith('.svgz')
+        if compressed:
+            import gzip
+        
+        # Generate the stamp (与 generate()/generate_bytes() 相同，去掉标签间空白后再写入)
+        data, error = self.generate_bytes()
         if error:
             return None, error
         
-        # Save to file
-        output_path = os.path.join(self.output_dir, filename)
+        # Save to file (UTF-8 字节直接写入，不经文本模式重新编码)
         try:
-            # SVG is text mode
-            with open(output_path, 'w') as f:
-                f.write(data)
+            if compressed:
+                with gzip.open(output_path, 'wb', compresslevel=SVGZ_COMPRESS_LEVEL) as f:
+                    f.write(data)
+            else:
+                with open(output_path, 'wb') as f:
+                    f.write(data)
             return f"/stamps/{filename}", None
         except Exception as e:
             return None, f"Error saving stamp to file: {e}"
 
+try:
+    # orjson 可选：C 实现的 JSON 序列化，直接输出 bytes
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+try:
+    # pybase64 可选：SIMD 加速的 base64 编码，接口与标准库一致
+    import pybase64 as _base64
+except ImportError:
+    _base64 = base64
+
+def b64encode_ascii(data):
+    """将字节数据 (bytes 或 memoryview，不复制) 编码为 base64 字符串"""
+    return _base64.b64encode(data).decode('ascii')
+
+def write_result(result, payloads=()):
+    """
+    将结果以单行JSON直接写入标准输出的字节流
+    
+    payloads 为原始输出模式下的数据块，依次紧跟在JSON行之后写出，每块以换行结尾；
+    块的长度由结果中的 size 字段给出
+    """
+    out = sys.stdout.buffer
+    out.write(_dumps(result) + b'\n')
+    for payload in payloads:
+        out.write(payload)
+        out.write(b'\n')
+    out.flush()
+
+def handle_request(input_data):
+    """
+    处理单个生成请求
+    
+    Returns:
+        (result, payload): 结果字典；rawOutput 模式下 payload 为SVG原始字节，否则为 None
+    """
+    # Create stamp generator
+    generator = StampGenerator(input_data)
+    
+    # Check if we need to save to file
+    if 'filename' in input_data:
+        # Save to file and return URL
+        url, error = generator.save_to_file(input_data['filename'])
+        if error:
+            return {'success': False, 'error': error}, None
+        return {'success': True, 'url': url}, None
+    
+    # Generate and return data as base64
+    data, error = generator.generate_bytes()
+    if error:
+        return {'success': False, 'error': error}, None
+    
+    if input_data.get('rawOutput'):
+        # 原始输出：JSON行只携带长度，SVG字节直接跟随其后，省去base64编码
+        return {'success': True, 'size': len(data)}, data
+    
+    # For SVG, just use the string data directly
+    encoded_data = b64encode_ascii(data)
+    return {'success': True, 'data': encoded_data}, None
+
+def _handle_batch_item(stamp_data):
+    """处理批量中的单个印章，异常转换为失败结果"""
+    try:
+        return handle_request(stamp_data)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, None
+
+def handle_batch(stamps):
+    """
+    批量处理多个印章请求，结果顺序与输入一致
+    
+    字体表和HarfBuzz缓存在模块级共享，一次调用内只扫描和解析一次；单个印章失败不影响其余印章。
+    每个印章使用独立的生成器和Cairo表面，多个印章由线程池并行渲染 (Cairo 绘制期间释放GIL)
+    """
+    if len(stamps) > 1 and MAX_BATCH_WORKERS > 1:
+        # 线程池只有批量模式用到，按需导入以减少单次调用的启动开销
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(MAX_BATCH_WORKERS, len(stamps))) as executor:
+            outcomes = list(executor.map(_handle_batch_item, stamps))
+    else:
+        outcomes = [_handle_batch_item(stamp_data) for stamp_data in stamps]
+    
+    results = [result for result, _ in outcomes]
+    payloads = [payload for _, payload in outcomes if payload is not None]
+    return results, payloads
+
+def process_input(input_data):
+    """
+    根据输入形式分派：列表或含 stamps 键时批量处理，否则按单个请求处理
+    
+    Returns:
+        (result, payloads): 结果 (批量时为列表) 以及按顺序排列的原始输出数据块
+    """
+    if isinstance(input_data, list):
+        return handle_batch(input_data)
+    if 'stamps' in input_data:
+        return handle_batch(input_data['stamps'])
+    result, payload = handle_request(input_data)
+    return result, () if payload is None else (payload,)
+
+def serve():
+    """
+    常驻模式：逐行读取JSON请求，每个请求输出一行JSON结果。
+    字体表、HarfBuzz和Cairo字体缓存在模块级共享，多个请求之间保持预热；
+    此模式下新建的缩放字体会预先加载常用字形，后续请求直接命中字形缓存。
+    """
+    global _prewarm_fonts
+    _prewarm_fonts = True
+    
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            write_result(*process_input(json.loads(line)))
+        except Exception as e:
+            write_result({'success': False, 'error': str(e)})
+
 def main():
     # Read JSON input from stdin
     try:
-        input_data = json.loads(sys.stdin.read())
-        
-        # Create stamp generator
-        generator = StampGenerator(input_data)
-        
-        # Check if we need to save to file
-        if 'filename' in input_data:
-            # Save to file and return URL
-            url, error = generator.save_to_file(input_data['filename'])
-            if error:
-                print(json.dumps({'success': False, 'error': error}))
-            else:
-                print(json.dumps({'success': True, 'url': url}))
+        first_line = sys.stdin.readline()
+        try:
+            input_data = json.loads(first_line)
+        except ValueError:
+            # 多行JSON输入，读取剩余部分后整体解析
+            input_data = json.loads(first_line + sys.stdin.read())
         else:
-            # Generate and return data as base64
-            data, error = generator.generate()
-            if error:
-                print(json.dumps({'success': False, 'error': error}))
-            else:
-                # For SVG, just use the string data directly
-                encoded_data = base64.b64encode(data.encode('utf-8')).decode('utf-8')
-                print(json.dumps({'success': True, 'data': encoded_data}))
+            if isinstance(input_data, dict) and input_data.get('mode') == 'server':
+                serve()
+                return
+        
+        write_result(*process_input(input_data))
                 
     except Exception as e:
         # Return error as JSON
-        print(json.dumps({'success': False, 'error': str(e)}))
+        write_result({'success': False, 'error': str(e)})
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,5 +1,5 @@
-import { Injectable, Logger } from '@nestjs/common';
-import { spawn } from 'child_process';
+import { Injectable, Logger, OnModuleDestroy } from '@nestjs/common';
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
 import * as path from 'path';
 import * as fs from 'fs';
 import * as crypto from 'crypto';
@@ -17,11 +17,30 @@ export interface FontSizeAdjustment {
   textScaleFactor: number;
 }
 
+// A request waiting for its response line from a persistent Python worker
+interface PendingRequest {
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+}
+
+// A long-lived generator process running in server mode (one JSON request/response per line)
+interface PythonWorker {
+  process: ChildProcessWithoutNullStreams;
+  pending: PendingRequest[];
+  buffer: string;
+  lastError: string;
+  // Timer for the request at the head of the queue (the one the worker is rendering)
+  timer?: NodeJS.Timeout;
+}
+
 @Injectable()
-export class PythonStampService {
+export class PythonStampService implements OnModuleDestroy {
   private readonly logger = new Logger(PythonStampService.name);
   private readonly pythonScriptPath: string;
   private readonly outputDir = 'uploads/stamps';
+  private readonly workers: PythonWorker[] = [];
+  private readonly maxWorkers = Math.max(1, parseInt(process.env.STAMP_PYTHON_WORKERS || '2', 10) || 1);
+  private readonly requestTimeoutMs = Math.max(1000, parseInt(process.env.STAMP_PYTHON_TIMEOUT_MS || '60000', 10) || 60000);
 
   constructor(
     @InjectRepository(Font)
@@ -104,67 +123,25 @@ export class PythonStampService {
     convertTextToPaths?: boolean;
     debug?: boolean;
   }): Promise<Buffer> {
-    return new Promise(async (resolve, reject) => {
-      // Get font mapping to send to Python script
-      const fontMapping = await this.getFontMapping();
-      
-      // Prepare data for Python script
-      const inputData = {
-        template,
-        textElements,
-        convertTextToPaths,
-        debug,
-        fontMapping
-      };
+    // Get font mapping to send to Python script
+    const fontMapping = await this.getFontMapping();
+    
+    // Prepare data for Python script
+    const inputData = {
+      template,
+      textElements,
+      convertTextToPaths,
+      debug,
+      fontMapping
+    };
 
-      // Spawn Python process
-      const pythonProcess = spawn('python3', [this.pythonScriptPath]);
-      
-      let resultData = '';
-      let errorData = '';
-      
-      // Handle stdout data
-      pythonProcess.stdout.on('data', (data) => {
-        resultData += data.toString();
-      });
-      
-      // Handle stderr data
-      pythonProcess.stderr.on('data', (data) => {
-        errorData += data.toString();
-        this.logger.debug(`Python stderr: ${data}`);
-      });
-      
-      // Handle process exit
-      pythonProcess.on('close', (code) => {
-        if (code !== 0) {
-          return reject(new Error(`Python process exited with code ${code}: ${errorData}`));
-        }
-        
-        try {
-          // Parse the JSON result
-          const result = JSON.parse(resultData);
-          
-          if (!result.success) {
-            return reject(new Error(`Python script error: ${result.error}`));
-          }
-          
-          // Convert base64 data to buffer
-          const buffer = Buffer.from(result.data, 'base64');
-          resolve(buffer);
-        } catch (error) {
-          reject(new Error(`Failed to parse Python script output: ${error.message}`));
-        }
-      });
-      
-      // Handle process error
-      pythonProcess.on('error', (error) => {
-        reject(new Error(`Failed to start Python process: ${error.message}`));
-      });
-      
-      // Send input data to Python script
-      pythonProcess.stdin.write(JSON.stringify(inputData));
-      pythonProcess.stdin.end();
-    });
+    const result = await this.runPython(inputData);
+    if (!result.success) {
+      throw new Error(`Python script error: ${result.error}`);
+    }
+    
+    // Convert base64 data to buffer
+    return Buffer.from(result.data, 'base64');
   }
 
   /**
@@ -186,85 +163,162 @@ export class PythonStampService {
     path: string;
     fontSizeAdjustments?: Record<string, FontSizeAdjustment>;
   }> {
-    return new Promise(async (resolve, reject) => {
-      // Get font mapping to send to Python script
-      const fontMapping = await this.getFontMapping();
-      
-      // Generate unique filename
-      const timestamp = Date.now();
-      const hash = crypto.createHash('md5').update(`${orderId}-${timestamp}`).digest('hex').substring(0, 8);
-      const fileExt = 'png'
-      const filename = `${orderId}_${timestamp}_${hash}.${fileExt}`;
-      
-      // Prepare data for Python script
-      const inputData = {
-        template,
-        textElements,
-        convertTextToPaths,
-        filename,
-        debug,
-        fontMapping
-      };
+    // Get font mapping to send to Python script
+    const fontMapping = await this.getFontMapping();
+    
+    // Generate unique filename
+    const timestamp = Date.now();
+    const hash = crypto.createHash('md5').update(`${orderId}-${timestamp}`).digest('hex').substring(0, 8);
+    const fileExt = 'png'
+    const filename = `${orderId}_${timestamp}_${hash}.${fileExt}`;
+    
+    // Prepare data for Python script
+    const inputData = {
+      template,
+      textElements,
+      convertTextToPaths,
+      filename,
+      debug,
+      fontMapping
+    };
 
-      // Spawn Python process
-      const pythonProcess = spawn('python3', [this.pythonScriptPath]);
-      
-      let resultData = '';
-      let errorData = '';
-      
-      // Handle stdout data
-      pythonProcess.stdout.on('data', (data) => {
-        resultData += data.toString();
-      });
-      
-      // Handle stderr data
-      pythonProcess.stderr.on('data', (data) => {
-        errorData += data.toString();
-        this.logger.debug(`Python stderr: ${data}`);
-      });
-      
-      // Handle process exit
-      pythonProcess.on('close', (code) => {
-        if (code !== 0) {
-          return reject(new Error(`Python process exited with code ${code}: ${errorData}`));
+    const result = await this.runPython(inputData);
+    if (!result.success) {
+      throw new Error(`Python script error: ${result.error}`);
+    }
+    
+    // Get the relative URL path
+    const stampImageUrl = `/stamps/${filename}`;
+    
+    // Get font size adjustments if available
+    const fontSizeAdjustments = result.fontSizeAdjustments;
+    
+    // Log font size adjustments for debugging
+    if (fontSizeAdjustments) {
+      this.logger.debug(`Received font size adjustments: ${JSON.stringify(fontSizeAdjustments)}`);
+    }
+    
+    return {
+      path: stampImageUrl,
+      fontSizeAdjustments
+    };
+  }
+
+  /**
+   * Send one request to a persistent Python worker and wait for its JSON response.
+   * Workers stay alive between requests, so Python startup, imports and font
+   * caches are paid once per worker instead of once per stamp.
+   */
+  private runPython(inputData: any): Promise<any> {
+    return new Promise((resolve, reject) => {
+      const worker = this.getWorker();
+      worker.pending.push({ resolve, reject });
+      if (worker.pending.length === 1) {
+        this.armTimeout(worker);
+      }
+      worker.process.stdin.write(JSON.stringify(inputData) + '\n');
+    });
+  }
+
+  /**
+   * Pick an idle worker, start a new one while under the limit,
+   * otherwise queue on the worker with the fewest pending requests
+   */
+  private getWorker(): PythonWorker {
+    const idle = this.workers.find(worker => worker.pending.length === 0);
+    if (idle) {
+      return idle;
+    }
+    if (this.workers.length < this.maxWorkers) {
+      return this.startWorker();
+    }
+    return this.workers.reduce((best, worker) => (worker.pending.length < best.pending.length ? worker : best));
+  }
+
+  /**
+   * Restart the timeout for the request at the head of the worker's queue.
+   * A worker that does not answer in time is dropped from the pool, fails all of
+   * its pending requests and is killed; the next request starts a fresh worker.
+   */
+  private armTimeout(worker: PythonWorker) {
+    clearTimeout(worker.timer);
+    worker.timer = undefined;
+    if (worker.pending.length === 0) {
+      return;
+    }
+    worker.timer = setTimeout(() => {
+      this.logger.error(`Python worker did not respond within ${this.requestTimeoutMs}ms, killing it`);
+      this.failWorker(worker, new Error(`Python script timed out after ${this.requestTimeoutMs}ms`));
+      worker.process.kill('SIGKILL');
+    }, this.requestTimeoutMs);
+  }
+
+  /**
+   * Drop a dead or hung worker from the pool and fail its pending requests;
+   * the next request starts a fresh one
+   */
+  private failWorker(worker: PythonWorker, error: Error) {
+    const index = this.workers.indexOf(worker);
+    if (index !== -1) {
+      this.workers.splice(index, 1);
+    }
+    clearTimeout(worker.timer);
+    worker.timer = undefined;
+    worker.pending.splice(0).forEach(request => request.reject(error));
+  }
+
+  private startWorker(): PythonWorker {
+    const pythonProcess = spawn('python3', [this.pythonScriptPath]);
+    const worker: PythonWorker = { process: pythonProcess, pending: [], buffer: '', lastError: '' };
+    this.workers.push(worker);
+
+    // Responses arrive one JSON object per line, in request order
+    pythonProcess.stdout.setEncoding('utf8');
+    pythonProcess.stdout.on('data', (data: string) => {
+      worker.buffer += data;
+      let newline: number;
+      while ((newline = worker.buffer.indexOf('\n')) !== -1) {
+        const line = worker.buffer.slice(0, newline);
+        worker.buffer = worker.buffer.slice(newline + 1);
+        const request = worker.pending.shift();
+        if (!request) {
+          continue;
         }
-        
+        this.armTimeout(worker);
         try {
-          // Parse the JSON result
-          const result = JSON.parse(resultData);
-          
-          if (!result.success) {
-            return reject(new Error(`Python script error: ${result.error}`));
-          }
-          
-          // Get the relative URL path
-          const stampImageUrl = `/stamps/${filename}`;
-          
-          // Get font size adjustments if available
-          const fontSizeAdjustments = result.fontSizeAdjustments;
-          
-          // Log font size adjustments for debugging
-          if (fontSizeAdjustments) {
-            this.logger.debug(`Received font size adjustments: ${JSON.stringify(fontSizeAdjustments)}`);
-          }
-          
-          resolve({
-            path: stampImageUrl,
-            fontSizeAdjustments
-          });
+          request.resolve(JSON.parse(line));
         } catch (error) {
-          reject(new Error(`Failed to parse Python script output: ${error.message}`));
+          request.reject(new Error(`Failed to parse Python script output: ${error.message}`));
         }
-      });
-      
-      // Handle process error
-      pythonProcess.on('error', (error) => {
-        reject(new Error(`Failed to start Python process: ${error.message}`));
-      });
-      
-      // Send input data to Python script
-      pythonProcess.stdin.write(JSON.stringify(inputData));
-      pythonProcess.stdin.end();
+      }
     });
+
+    // Handle stderr data (keep only the tail for error messages)
+    pythonProcess.stderr.on('data', (data) => {
+      worker.lastError = (worker.lastError + data.toString()).slice(-4096);
+      this.logger.debug(`Python stderr: ${data}`);
+    });
+
+    // A dead worker is dropped from the pool and fails its pending requests
+    const fail = (error: Error) => this.failWorker(worker, error);
+    pythonProcess.on('close', (code) => {
+      fail(new Error(`Python process exited with code ${code}: ${worker.lastError}`));
+    });
+    pythonProcess.on('error', (error) => {
+      fail(new Error(`Failed to start Python process: ${error.message}`));
+    });
+    pythonProcess.stdin.on('error', (error) => {
+      fail(new Error(`Failed to write to Python process: ${error.message}`));
+    });
+
+    pythonProcess.stdin.write(JSON.stringify({ mode: 'server' }) + '\n');
+    return worker;
+  }
+
+  onModuleDestroy() {
+    for (const worker of this.workers.splice(0)) {
+      clearTimeout(worker.timer);
+      worker.process.stdin.end();
+    }
   }
 } 
\ No newline at end of file